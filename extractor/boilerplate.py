@@ -0,0 +1,353 @@
+import logging
+import glob
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import dill
+import numpy as np
+from scipy import sparse
+
+from extractor.parser import Parser
+from extractor.util import configure_logging
+
+configure_logging()
+logger = logging.getLogger('applog.' + __name__)
+
+FILE_BOILERPLATE = 'data/boilerplate.pkl'
+
+BLOCK_TAGS = frozenset(['div', 'section', 'aside', 'nav', 'header', 'footer', 'ul', 'ol', 'dl', 'table', 'form'])
+# blocks with shorter normalized text are not indexed
+PARAM_MIN_BLOCK_TEXT_LENGTH = 10
+PARAM_NGRAM = 3
+PARAM_SIMHASH_BITS = 64
+# the simhash is split into bands of 16 bits, a block within PARAM_MAX_HAMMING_DISTANCE shares at least one band
+PARAM_SIMHASH_BANDS = 4
+PARAM_MAX_HAMMING_DISTANCE = 3
+# a block on more than this share of the pages of a domain is boilerplate
+PARAM_BOILERPLATE_RATIO = 0.6
+# pages of a domain to observe before removing any block
+PARAM_MIN_DOCS = 20
+# a block holding more than this share of the body text is never dropped
+PARAM_MAX_BLOCK_TEXT_SHARE = 0.5
+# counts are multiplied by this for every page of the domain, so that old layouts fade out
+PARAM_DECAY = 0.995
+PARAM_MAX_BLOCKS_PER_DOMAIN = 5000
+# URLs remembered per domain, so that a page crawled again is not counted again
+PARAM_MAX_URLS_PER_DOMAIN = 10000
+PARAM_MAX_DOMAINS = 1000
+
+__BAND_BITS = PARAM_SIMHASH_BITS // PARAM_SIMHASH_BANDS
+__BAND_MASK = (1 << __BAND_BITS) - 1
+__BIT_VALUES = np.uint64(1) << np.arange(PARAM_SIMHASH_BITS, dtype=np.uint64)
+# code points matched by `\s`
+__SPACE_CODES = np.array([c for c in range(0x3001) if re.match(r'\s', chr(c))], dtype=np.uint32)
+
+def get_domain(url):
+    if not url:
+        return None
+    return urlsplit(url).hostname
+
+def _normalize_codes(texts):
+    """
+    Code points of the texts lowered, without spaces and with runs of digits folded to one zero,
+    normalized at once for all texts, and the length of each text. Digits are folded in ASCII and full-width only.
+    """
+    text = ''.join(texts)
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # a few characters lower to more than one
+        texts = [t.lower() for t in texts]
+        lowered = ''.join(texts)
+    codes = np.frombuffer(lowered.encode('utf-32-le'), dtype=np.uint32)
+    ids = np.repeat(np.arange(len(texts)), [len(t) for t in texts])
+
+    keep = ~np.isin(codes, __SPACE_CODES)
+    codes = codes[keep].astype(np.uint64)
+    for zero in (ord('0'), ord('０')):
+        is_digit = (codes >= zero) & (codes < zero + 10)
+        codes[is_digit] = ord('0')
+    # runs of digits fold to one zero
+    is_zero = codes == ord('0')
+    repeated = np.zeros(len(codes), dtype=bool)
+    repeated[1:] = is_zero[1:] & is_zero[:-1] & (ids[keep][1:] == ids[keep][:-1])
+    ids = ids[keep][~repeated]
+    return codes[~repeated], np.bincount(ids, minlength=len(texts))
+
+def _hash_ngrams(codes):
+    """
+    64-bit hash of the character n-gram starting at each position: code points packed in 21 bits each
+    and mixed by the splitmix64 finalizer.
+    """
+    n = len(codes) - PARAM_NGRAM + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    h = np.zeros(n, dtype=np.uint64)
+    for i in range(PARAM_NGRAM):
+        h = (h << np.uint64(21)) | codes[i:i + n]
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94d049bb133111eb)
+    h ^= h >> np.uint64(31)
+    return h
+
+def _ngram_weights(codes, lengths):
+    """
+    Simhash weights of each text: +1/-1 per bit summed over the n-grams inside the text.
+    """
+    hashes = _hash_ngrams(codes)
+    num_of_grams = np.maximum(lengths - PARAM_NGRAM + 1, 0)
+    total = int(num_of_grams.sum())
+    if total == 0:
+        return np.zeros((len(lengths), PARAM_SIMHASH_BITS), dtype=np.int64)
+
+    # the n-grams of each text, leaving out the ones crossing two texts
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    indptr = np.concatenate([[0], np.cumsum(num_of_grams)])
+    positions = np.arange(total) + np.repeat(offsets - indptr[:-1], num_of_grams)
+    bits = np.unpackbits(hashes[positions].view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    # sum the bits of the n-grams of each text as a product with a text-by-n-gram matrix
+    segments = sparse.csr_matrix((np.ones(total, dtype=np.int32), np.arange(total), indptr), shape=(len(lengths), total))
+    ones = np.asarray(segments @ bits.astype(np.int32), dtype=np.int64)
+    return 2 * ones - num_of_grams[:, None]
+
+def _simhashes(weights):
+    return ((weights > 0).astype(np.uint64) * __BIT_VALUES).sum(axis=1, dtype=np.uint64)
+
+def _bands(simhash):
+    return [(b, (simhash >> (b * __BAND_BITS)) & __BAND_MASK) for b in range(PARAM_SIMHASH_BANDS)]
+
+def get_blocks(parser):
+    """
+    (element, path hash, simhash, text length) of the blocks under the body, parents before children,
+    and the text length of the body.
+    The n-grams of the text directly in each element are hashed at once for the whole page,
+    and the simhash weights of a block are summed over its subtree in preorder.
+    """
+    els = []
+    paths = []
+    texts = []
+    # index after the last node of the subtree of each node in preorder
+    ends = []
+
+    stack = [(parser.body, parser.get_tag(parser.body), None)]
+    while len(stack) > 0:
+        el, path, parent_idx = stack.pop()
+        if el is None:
+            ends[parent_idx] = len(els)
+            continue
+        idx = len(els)
+        els.append(el)
+        paths.append(path)
+        ends.append(None)
+
+        # text directly in the element and the tails of its children
+        text = [parser.get_text(el)]
+        children = []
+        for el_ch in parser.iter_children(el):
+            text.append(parser.get_tail_text(el_ch))
+            tag = parser.get_tag(el_ch)
+            if isinstance(tag, str):
+                children.append((el_ch, f"{path}/{tag}{''.join('.' + a for a in parser.get_attrs(el_ch))}", idx))
+        texts.append(''.join(text))
+        stack.append((None, None, idx))
+        stack.extend(reversed(children))
+
+    n = len(els)
+    ends = np.array(ends)
+    codes, lengths = _normalize_codes(texts)
+    weights = _ngram_weights(codes, lengths)
+
+    # sums over the subtree [i, ends[i]) in preorder
+    def subtree_sum(values):
+        cumsum = np.concatenate([np.zeros((1,) + values.shape[1:], dtype=values.dtype), np.cumsum(values, axis=0)])
+        return cumsum[ends] - cumsum[np.arange(n)]
+
+    subtree_weights = subtree_sum(weights)
+    subtree_lengths = subtree_sum(lengths)
+
+    is_block = np.array([parser.get_tag(el) in BLOCK_TAGS for el in els]) & (subtree_lengths >= PARAM_MIN_BLOCK_TEXT_LENGTH)
+    idxs = np.flatnonzero(is_block)
+    simhashes = _simhashes(subtree_weights[idxs])
+    blocks = [
+        (els[i], zlib.crc32(paths[i].encode()), int(simhash), int(subtree_lengths[i]))
+        for i, simhash in zip(idxs, simhashes)
+    ]
+    return blocks, int(subtree_lengths[0])
+
+class DomainIndex():
+    """
+    Block fingerprints of one domain with decayed page counts.
+    Blocks are looked up through the bands of their simhash, and the least recently seen block is evicted first.
+    """
+    def __init__(self, max_blocks=PARAM_MAX_BLOCKS_PER_DOMAIN, max_urls=PARAM_MAX_URLS_PER_DOMAIN):
+        self.max_blocks = max_blocks
+        self.max_urls = max_urls
+        # URLs already counted, the least recently seen first
+        self.urls = OrderedDict()
+        self.num_of_docs = 0
+        self.decayed_docs = 0.0
+        # (path hash, simhash) -> [decayed count, page number of the last update]
+        self.blocks = OrderedDict()
+        # (path hash, band, value) -> (path hash, simhash)
+        self.bands = {}
+
+    def find(self, path, simhash):
+        key = (path, simhash)
+        if key in self.blocks:
+            return key
+        for band in _bands(simhash):
+            found = self.bands.get((path, *band))
+            if found is not None and bin(found[1] ^ simhash).count('1') <= PARAM_MAX_HAMMING_DISTANCE:
+                return found
+        return None
+
+    def count(self, key):
+        count, last = self.blocks[key]
+        return count * PARAM_DECAY ** (self.num_of_docs - last)
+
+    def ratio(self, key):
+        if self.num_of_docs < PARAM_MIN_DOCS or key not in self.blocks:
+            return 0.0
+        return self.count(key) / self.decayed_docs
+
+    def is_new_url(self, url):
+        """
+        Remember `url` and tell whether it has not been counted yet.
+        """
+        is_new = url not in self.urls
+        self.urls[url] = True
+        self.urls.move_to_end(url)
+        while len(self.urls) > self.max_urls:
+            self.urls.popitem(last=False)
+        return is_new
+
+    def observe(self, blocks):
+        """
+        Count the blocks of a page, each block at most once. Returns the key of each block.
+        """
+        self.num_of_docs += 1
+        self.decayed_docs = self.decayed_docs * PARAM_DECAY + 1
+        keys = []
+        seen = set()
+        for path, simhash in blocks:
+            key = self.find(path, simhash)
+            if key is None:
+                key = (path, simhash)
+                self.blocks[key] = [0.0, self.num_of_docs]
+                for band in _bands(simhash):
+                    self.bands.setdefault((path, *band), key)
+            if key not in seen:
+                seen.add(key)
+                self.blocks[key] = [self.count(key) + 1, self.num_of_docs]
+                self.blocks.move_to_end(key)
+            keys.append(key)
+
+        while len(self.blocks) > self.max_blocks:
+            self.__evict()
+        return keys
+
+    def __evict(self):
+        key, _ = self.blocks.popitem(last=False)
+        path, simhash = key
+        for band in _bands(simhash):
+            if self.bands.get((path, *band)) == key:
+                del self.bands[(path, *band)]
+
+class BoilerplateIndex():
+    """
+    Per-domain index of the blocks repeated across pages (navigation, footers, related articles, SNS widgets).
+
+    usage:
+        index = BoilerplateIndex()
+        tree = DOMTree('lxml', html, prune=partial(index.prune, url))
+    """
+    def __init__(self, max_domains=PARAM_MAX_DOMAINS, max_blocks=PARAM_MAX_BLOCKS_PER_DOMAIN):
+        self.max_domains = max_domains
+        self.max_blocks = max_blocks
+        self.domains = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def prune(self, url, parser, update=True):
+        """
+        Drop the boilerplate blocks of the domain of `url` from the parsed document.
+        With `update`, the blocks of the page are counted first, once per URL.
+        Blocks holding a title candidate or more than PARAM_MAX_BLOCK_TEXT_SHARE of the body text are kept.
+        Returns the number of dropped blocks.
+        """
+        domain = get_domain(url)
+        if domain is None:
+            return 0
+        blocks, body_text_length = get_blocks(parser)
+
+        with self._lock:
+            index = self.domains.get(domain)
+            if index is None:
+                if not update:
+                    return 0
+                index = self.domains[domain] = DomainIndex(self.max_blocks)
+            self.domains.move_to_end(domain)
+            if update and index.is_new_url(url):
+                keys = index.observe([(path, simhash) for _, path, simhash, _ in blocks])
+            else:
+                keys = [index.find(path, simhash) for _, path, simhash, _ in blocks]
+            is_boilerplate = [key is not None and index.ratio(key) > PARAM_BOILERPLATE_RATIO for key in keys]
+            while len(self.domains) > self.max_domains:
+                self.domains.popitem(last=False)
+
+        # the outermost blocks only, since children go with their parents
+        dropped = set()
+        for (el, _, _, text_length), drop in zip(blocks, is_boilerplate):
+            if not drop or text_length > body_text_length * PARAM_MAX_BLOCK_TEXT_SHARE:
+                continue
+            if any(a in dropped for a in parser.iter_ancestors(el)):
+                continue
+            if parser.is_title(el) or any(parser.is_title(d) for d in parser.find_all('*', el)):
+                continue
+            parser.drop(el)
+            dropped.add(el)
+        if len(dropped) > 0:
+            logger.debug(f'{domain}: dropped {len(dropped)} boilerplate blocks')
+        return len(dropped)
+
+    def stats(self):
+        return {
+            domain: {
+                'docs': index.num_of_docs,
+                'blocks': len(index.blocks),
+                'boilerplate': sum(index.ratio(key) > PARAM_BOILERPLATE_RATIO for key in index.blocks),
+            }
+            for domain, index in self.domains.items()
+        }
+
+    def build(self, snapshot):
+        """
+        Count the blocks of the pages in a snapshot directory laid out as <snapshot>/<domain>/**/*.html.
+        """
+        for html_path in sorted(glob.glob(os.path.join(snapshot, '*', '**', '*.html'), recursive=True)):
+            domain, *path = os.path.relpath(html_path, snapshot).split(os.sep)
+            with open(html_path, 'rb') as f:
+                parser = Parser('lxml', f.read())
+            self.prune(f"http://{domain}/{'/'.join(path)}", parser)
+        logger.info(f'boilerplate index: {self.stats()}')
+        return self
+
+    def save(self, path=FILE_BOILERPLATE):
+        with self._lock, open(path, 'wb') as f:
+            dill.dump(self, f)
+
+def load_index(path=FILE_BOILERPLATE):
+    with open(path, 'rb') as f:
+        return dill.load(f)
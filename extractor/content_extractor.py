@@ -1,34 +1,39 @@
 import logging
 
 import re
+import time
 from collections import namedtuple
+from functools import partial
 import numpy as np
 import pandas as pd
 
+from extractor.diagnostics import build_trace
 from extractor.dom import DOMTree
-from extractor.util import load_log_config, clean_text
+from extractor.incremental import Entry
+from extractor.util import configure_logging, clean_text
 from extractor import feature as _feature
 
-logging.config.dictConfig(load_log_config())
+configure_logging()
 logger = logging.getLogger('applog.' + __name__)
 
 REGEX_INVALID_ATTR = re.compile('header|related|footer|sns', re.IGNORECASE)
 PARAM_THRESHOLD_RATIO      = 0.1
 PARAM_MINIMUM_TEXT_DENSITY = 5.0
+# send only the nodes passing the rules below to the model, off until `prefilter-report` is checked on a snapshot
+PARAM_PREFILTER = False
+# share of the body text below which a low density node is not a candidate
+PARAM_CANDIDATE_MINIMUM_TEXT_SHARE = 0.01
 
-def extract(model, html_string, debug=False):
-    tree = DOMTree('lxml', html_string)
+Feature = namedtuple('feature', ('concat_attr_name', 'title_dist', 'text_density', 'is_article',))
 
+def get_features(tree):
+    """
+    Features of the nodes to score, and the nodes to drop from the content.
+    """
     nodes = []
     drop_nodes = []
     features = []
-    feature = namedtuple('feature', ('concat_attr_name', 'title_dist', 'text_density', 'is_article',))
-
-    result = {
-        'score': 0.0,
-        'content': '',
-        'image_urls': []
-    }
+    text_lengths = []
     for node, attr in tree.iter_nodes():
         if _feature.is_title_candidates(tree, node):
             if node == tree.title_el:
@@ -54,39 +59,187 @@ def extract(model, html_string, debug=False):
         parent_attr_name = '_txt'
         
         
-        f = feature(
+        f = Feature(
             concat_attr_name='|'.join([attr_name, parent_attr_name]),
-            title_dist=tree.get_distance_from_title(node, attr['location']),
+            title_dist=attr['title_dist'],
             text_density=attr.get('text_density', 0.0),
             is_article=attr['is_article'],
         )
         features.append(f)
         nodes.append(node)
+        text_lengths.append(attr['text_length'])
+
+    return nodes, drop_nodes, features, text_lengths
+
+def is_candidate(feature, text_length, body_text_length):
+    """
+    Rule stage of the cascade: discard nodes which can never be the best block.
+    """
+    if text_length == 0:
+        return False
+    if feature.text_density < PARAM_MINIMUM_TEXT_DENSITY and \
+        text_length / max(body_text_length, 1) < PARAM_CANDIDATE_MINIMUM_TEXT_SHARE:
+        return False
+    return True
+
+def predict(model, features, text_lengths, body_text_length, prefilter=None, cached_scores=None):
+    """
+    Score the nodes with the model. With `prefilter` (default: PARAM_PREFILTER), only the nodes passing the rule stage
+    are sent to the model and the others are scored NaN, so that they are not selected but are still treated as low score nodes.
+    Nodes with a score in `cached_scores` (None for the others) are not sent to the model either.
+    """
+    prefilter = PARAM_PREFILTER if prefilter is None else prefilter
+    if not prefilter and cached_scores is None:
+        return model.predict(pd.DataFrame(features))
+
+    candidates = list(range(len(features)))
+    if prefilter:
+        candidates = [i for i, (f, text_length) in enumerate(zip(features, text_lengths)) if is_candidate(f, text_length, body_text_length)]
+        # fall back to full scoring when the rules discard everything
+        if len(candidates) == 0:
+            candidates = list(range(len(features)))
+
+    pred = np.full(len(features), np.nan)
+    if cached_scores is not None:
+        for i in candidates:
+            if cached_scores[i] is not None:
+                pred[i] = cached_scores[i]
+        candidates = [i for i in candidates if cached_scores[i] is None]
+
+    if len(candidates) > 0:
+        pred[candidates] = model.predict(pd.DataFrame([features[i] for i in candidates]))
+    return pred
+
+def extract(model, html_string, debug=False, encoding=None, prefilter=None, store=None, url=None, boilerplate=None, content_type=None):
+    """
+    With `debug`, the ranking of the top candidates is returned as `trace` in the result.
+    With `store` (FingerprintStore) and `url`, the raw counts and scores of subtrees unchanged
+    since the last extraction of the url are reused, and an unchanged page returns the last result.
+    With `boilerplate` (BoilerplateIndex) and `url`, the page is counted in the index of its domain
+    and the blocks repeated across the domain are dropped before featurization.
+    `content_type` is the HTTP Content-Type header of `html_string`, whose charset is used unless a BOM says otherwise.
+    """
+    incremental = store is not None and url is not None
+    entry = store.get(url) if incremental else None
+    counts_cache = None
+    if incremental:
+        counts_cache = entry.counts if entry is not None else {}
+    prune = partial(boilerplate.prune, url) if boilerplate is not None and url is not None else None
+    tree = DOMTree('lxml', html_string, encoding, counts_cache, prune, content_type)
+
+    page_fingerprint = (tree.fingerprints[0], tree.parser.title) if incremental else None
+    if entry is not None and entry.page_fingerprint == page_fingerprint and not debug:
+        return dict(entry.result)
+
+    result = {
+        'score': 0.0,
+        'content': '',
+        'image_urls': []
+    }
+    nodes, drop_nodes, features, text_lengths = get_features(tree)
 
     if len(features) == 0:
         logger.warn('there are no features')
         return result
 
-    pred = model.predict(pd.DataFrame(features))
-    best_idx = pred.argmax()
+    cached_scores = None
+    if entry is not None:
+        cached_scores = []
+        for node, f in zip(nodes, features):
+            cached = entry.scores.get(tree.get_fingerprint(node))
+            # the features of a node can change with the other nodes (e.g. distance from title)
+            cached_scores.append(cached[1] if cached is not None and cached[0] == f else None)
+
+    pred = predict(model, features, text_lengths, tree.body_text_length, prefilter, cached_scores)
+    if incremental:
+        # keep only the scores given by the model, since the others depend on the rule stage
+        scores = {
+            tree.get_fingerprint(node): (f, float(p))
+            for node, f, p in zip(nodes, features, pred)
+            if not np.isnan(p)
+        }
+    result.update(assemble(tree, nodes, drop_nodes, features, pred))
+
+    if incremental:
+        store.put(url, Entry(page_fingerprint, tree.own_counts, scores, dict(result)))
+
+    if debug:
+        result['trace'] = build_trace(tree, nodes, features, pred)
+
+    return result
+
+def assemble(tree, nodes, drop_nodes, features, pred):
+    """
+    Select the best node among the scored nodes, drop the low score nodes from it and return its content.
+    Nodes not scored by the model (NaN) are never selected and are treated as low score nodes.
+    """
+    best_idx = np.nanargmax(pred)
     best_score = float(pred[best_idx])
     best_node = nodes[best_idx]
 
     for node in drop_nodes:
         tree.parser.drop(node)
 
-    for idx in np.where(pred < best_score * PARAM_THRESHOLD_RATIO)[0]:
-        if features[idx].text_density < PARAM_MINIMUM_TEXT_DENSITY:
+    for idx in range(len(nodes)):
+        is_low = np.isnan(pred[idx]) or pred[idx] < best_score * PARAM_THRESHOLD_RATIO
+        if is_low and features[idx].text_density < PARAM_MINIMUM_TEXT_DENSITY:
             # logger.debug(f'drop: {tree.parser.get_tag(nodes[idx])}{tree.parser.get_attrs(nodes[idx])} ' + \
             #     f'{round(float(pred[idx]), 5)}, {features[idx]}')
             tree.parser.drop(nodes[idx])
 
-    result['score'] = best_score
-    result['content'] = clean_text(tree.parser.get_all_text(best_node))
-    result['image_urls'] = tree.parser.get_image_urls(best_node)
+    return {
+        'score': best_score,
+        'content': clean_text(tree.parser.get_all_text(best_node)),
+        'image_urls': tree.parser.get_image_urls(best_node),
+    }
 
-    if debug:
-        for _idx, idx in enumerate(np.argsort(pred)[::-1]):
-            logger.info(f'{round(float(pred[idx]), 5)}: {features[idx]}')
+def evaluate_prefilter(model, html_strings):
+    """
+    Measure how often the cascade changes the best node and the extracted content compared with full scoring.
+    """
+    num_of_docs = 0
+    num_of_changed = 0
+    num_of_content_changed = 0
+    num_of_nodes = 0
+    num_of_candidates = 0
+    full_time = 0.0
+    prefilter_time = 0.0
+    for html_string in html_strings:
+        tree = DOMTree('lxml', html_string)
+        nodes, drop_nodes, features, text_lengths = get_features(tree)
+        if len(features) == 0:
+            continue
 
-    return result
+        start = time.perf_counter()
+        full_pred = predict(model, features, text_lengths, tree.body_text_length, prefilter=False)
+        full_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        pred = predict(model, features, text_lengths, tree.body_text_length, prefilter=True)
+        prefilter_time += time.perf_counter() - start
+
+        num_of_docs += 1
+        num_of_nodes += len(features)
+        num_of_candidates += sum(is_candidate(f, text_length, tree.body_text_length) for f, text_length in zip(features, text_lengths))
+        if nodes[np.nanargmax(full_pred)] != nodes[np.nanargmax(pred)]:
+            num_of_changed += 1
+
+        # the content is assembled on a fresh tree for each, since nodes are dropped from the tree
+        full_content = assemble(tree, nodes, drop_nodes, features, full_pred)['content']
+        tree = DOMTree('lxml', html_string)
+        nodes, drop_nodes, features, _ = get_features(tree)
+        if full_content != assemble(tree, nodes, drop_nodes, features, pred)['content']:
+            num_of_content_changed += 1
+
+    report = {
+        'docs': num_of_docs,
+        'changed': num_of_changed,
+        'changed_ratio': num_of_changed / max(num_of_docs, 1),
+        'content_changed': num_of_content_changed,
+        'content_changed_ratio': num_of_content_changed / max(num_of_docs, 1),
+        'candidate_ratio': num_of_candidates / max(num_of_nodes, 1),
+        'full_time': full_time,
+        'prefilter_time': prefilter_time,
+    }
+    logger.info(f'prefilter report: {report}')
+    return report
@@ -0,0 +1,83 @@
+import logging
+import logging.handlers
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import numpy as np
+
+from extractor.util import configure_logging
+
+configure_logging()
+logger = logging.getLogger('applog.' + __name__)
+
+# ratio of requests whose ranking trace is logged, a request can also ask for it by TRACE_HEADER
+PARAM_TRACE_SAMPLE_RATE = float(os.getenv('EXTRACT_TRACE_SAMPLE_RATE', '0.0'))
+PARAM_TRACE_TOP_K = 10
+TRACE_HEADER = 'X-Extract-Trace'
+
+# the queue listener is started lazily in each process, since its thread does not survive fork
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+def should_trace(requested=False):
+    return requested or random.random() < PARAM_TRACE_SAMPLE_RATE
+
+def build_trace(tree, nodes, features, pred, k=PARAM_TRACE_TOP_K):
+    """
+    Top-k candidates with their scores and features. Nodes not scored by the model (NaN) are left out.
+    """
+    scored = np.flatnonzero(~np.isnan(pred))
+    k = min(k, len(scored))
+    top = scored[np.argpartition(-pred[scored], k - 1)[:k]]
+    top = top[np.argsort(-pred[top], kind='stable')]
+    candidates = []
+    for rank, idx in enumerate(top, 1):
+        f = features[idx]
+        candidates.append({
+            'rank': rank,
+            'score': float(pred[idx]),
+            'node': f'{tree.parser.get_tag(nodes[idx])}{tree.parser.get_attrs(nodes[idx])}',
+            'concat_attr_name': f.concat_attr_name,
+            'title_dist': float(f.title_dist),
+            'text_density': float(f.text_density),
+            'is_article': bool(f.is_article),
+        })
+    return {
+        'num_of_nodes': len(pred),
+        'candidates': candidates,
+    }
+
+def _setup_queue_handler():
+    """
+    Write traces through a queue, so that the request thread does not block on the handlers of `applog`.
+    """
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid():
+        return
+
+    # threads of a worker may emit their first traces at the same time
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        q = queue.Queue(-1)
+        handlers = logging.getLogger('applog').handlers
+        _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        logger.handlers = [logging.handlers.QueueHandler(q)]
+        logger.propagate = False
+        _listener_pid = os.getpid()
+
+def emit_trace(trace, **context):
+    """
+    Emit a trace as a single structured record.
+    """
+    _setup_queue_handler()
+    record = dict(context)
+    record.update(trace)
+    logger.info(json.dumps(record, ensure_ascii=False))
@@ -1,16 +1,17 @@
 import logging
 from collections import Counter
 import re
+import hashlib
 import networkx as nx
 import numpy as np
 from difflib import SequenceMatcher
-import math
 import signal
 
+from extractor import kernel
 from extractor.parser import Parser
-from extractor.util import load_log_config, remove_space, time_limit
+from extractor.util import configure_logging, remove_space, time_limit
 
-logging.config.dictConfig(load_log_config())
+configure_logging()
 logger = logging.getLogger('applog.' + __name__)
 
 NODE_TAGS = frozenset(['div', 'article', 'section', 'main', 'ul', 'li', 'p', 'header', 'blockquote', 'span',])
@@ -20,16 +21,35 @@ PARAM_PRIOR_TITLE_COST = 5
 PARAM_UNKNOWN_TITLE_LOCATION_RATIO = 0.2
 
 class DOMTree():
-    def __init__(self, parser_type='lxml', html_string=''):
+    def __init__(self, parser_type='lxml', html_string='', encoding=None, counts_cache=None, prune=None, content_type=None):
+        """
+        `counts_cache` maps subtree fingerprints to raw counts of a previous build of the same page.
+        When it is given, fingerprints are computed and nodes found in it reuse the counts.
+        `prune` is called with the parser before the nodes are created, e.g. to drop boilerplate blocks.
+        `content_type` is the HTTP Content-Type header of the page, used to resolve the encoding when `encoding` is not given.
+        """
         self.__G = None
         self.title_candidates = []
         self.title_location = None
-
-        self.parser = Parser(parser_type, html_string)
+        self.body_stat = None
+        # nodes in preorder and their raw counts
+        self.__nodes = []
+        self.__index = {}
+        self.node_counts = {}
+        self.__body_text_length = 0
+        self.__location_text_length = None
+        self.counts_cache = counts_cache
+        # subtree fingerprints in preorder and raw counts by fingerprint, only with `counts_cache`
+        self.fingerprints = None
+        self.own_counts = {}
+
+        self.parser = Parser(parser_type, html_string, encoding, content_type)
+        if prune is not None:
+            prune(self.parser)
         self._create_nodes(self.parser.body)
         self.title_el = self.__select_best_title()
-        text_stats = self.set_text_density()
-        self.set_distance_from_title(text_stats)
+        self.set_text_density()
+        self.set_distance_from_title()
 
     def __select_best_title(self):
         if len(self.title_candidates) == 0:
@@ -69,25 +89,9 @@ class DOMTree():
 
     def set_text_density(self):
         """
-        Augment text statistics from the end node to calculate text density.
+        Collect raw counts of each node in preorder and calculate text density with array kernels.
+        Counts of an end node cover its whole subtree, since its descendants are not in the tree.
         """
-        stats = {}
-        def add_stat(el, num_of_tags, num_of_link_tags, text_length, link_text_length, text_density):
-            if el in stats:
-                stats[el]['num_of_tags'] += num_of_tags
-                stats[el]['num_of_link_tags'] += num_of_link_tags
-                stats[el]['text_length'] += text_length
-                stats[el]['link_text_length'] += link_text_length
-                stats[el]['text_density'] += text_density
-            else:
-                stats[el] = {
-                    'num_of_tags': num_of_tags,
-                    'num_of_link_tags': num_of_link_tags,
-                    'text_length': text_length,
-                    'link_text_length': link_text_length,
-                    'text_density': text_density,
-                }
-
         def get_body_stat():
             text = self.parser.get_all_text(self.parser.body)
             text_length = len(remove_space(text))
@@ -95,80 +99,130 @@ class DOMTree():
             link_text_length = sum([len(remove_space(self.parser.get_all_text(_el))) for _el in link_els])
             return max(link_text_length, 1)/max(text_length, 1)
 
-        edges = nx.dfs_labeled_edges(self.__G)
-        body_stat = get_body_stat()
+        self.__nodes = list(nx.dfs_preorder_nodes(self.__G))
+        self.__index = index = {el: i for i, el in enumerate(self.__nodes)}
+        n = len(self.__nodes)
+        parent = np.full(n, -1, dtype=np.int64)
+        is_leaf = np.array([self.__G.out_degree(el) == 0 for el in self.__nodes], dtype=bool)
+        if self.counts_cache is not None:
+            self.fingerprints = self.__get_fingerprints(index, is_leaf)
+
+        counts = np.zeros((n, 6))
+        for i, el in enumerate(self.__nodes):
+            parent_el = self.get_parent_node(el)
+            if parent_el is not None:
+                parent[i] = index[parent_el]
+
+            cached = self.counts_cache.get(self.fingerprints[i]) if self.counts_cache is not None else None
+            counts[i] = cached if cached is not None else self.__count_node(el, is_leaf[i])
+
+        if self.counts_cache is not None:
+            self.own_counts = dict(zip(self.fingerprints, map(tuple, counts.tolist())))
+        num_of_tags, num_of_link_tags, text_length, link_text_length, is_link, tail_text_length = counts.T
+        is_link = is_link.astype(bool)
+        self.node_counts = {
+            'parent_id': parent,
+            'is_leaf': is_leaf,
+            'num_of_tags': num_of_tags,
+            'num_of_link_tags': num_of_link_tags,
+            'text_length': text_length,
+            'link_text_length': link_text_length,
+            'is_link': is_link,
+            'tail_text_length': tail_text_length,
+        }
+
+        # the body statistics only change with the fingerprint of the root
+        body_stat_key = ('body_stat', self.fingerprints[0]) if self.counts_cache is not None else None
+        self.body_stat = self.counts_cache.get(body_stat_key) if body_stat_key is not None else None
+        if self.body_stat is None:
+            self.body_stat = get_body_stat()
+        if body_stat_key is not None:
+            self.own_counts[body_stat_key] = self.body_stat
+        num_of_tags, num_of_link_tags, text_length, link_text_length, location_text_length = kernel.aggregate_counts(
+            parent, is_leaf, num_of_tags, num_of_link_tags, text_length, link_text_length, tail_text_length)
+        density = kernel.text_density(num_of_tags, num_of_link_tags, text_length, link_text_length, self.body_stat)
+        self.__body_text_length = text_length[0]
+        self.__location_text_length = location_text_length
+
+        self.set_node_attributes('text_density', dict(zip(self.__nodes, kernel.node_text_density(density, parent, is_link))))
+        self.set_node_attributes('text_length', dict(zip(self.__nodes, text_length)))
+
+    def __count_node(self, el, is_leaf):
+        """
+        Raw counts of a node: (num_of_tags, num_of_link_tags, text_length, link_text_length, is_link, tail_text_length)
+        """
+        num_of_link_tags = 0
+        link_text_length = 0
+        is_link = False
+        tail_text_length = len(remove_space(self.parser.get_tail_text(el)))
+
+        # the end node
+        if is_leaf:
+            __link_els = self.parser.find_all('a', el)
+            __num_of_all_tags = self.parser.count_tag(el, recursive=True)
+            __num_of_text_tags = self.parser.count_tag(el, 'p', recursive=True) + self.parser.count_tag(el, 'br', recursive=True)
+
+            num_of_tags = __num_of_all_tags - __num_of_text_tags
+            num_of_link_tags = len(__link_els)
+            text_length = len(remove_space(self.parser.get_all_text(el)))
+
+            if self.parser.get_tag(el) == 'a':
+                is_link = True
+                link_text_length = text_length
+                num_of_link_tags += 1
+            else:
+                link_text_length = sum([len(remove_space(self.parser.get_all_text(_el))) for _el in __link_els])
+        else:
+            __num_of_all_tags = self.parser.count_tag(el)
+            __num_of_text_tags = self.parser.count_tag(el, 'p') + self.parser.count_tag(el, 'br')
 
-        for parent_el, el, d in edges:
-            if d != 'reverse':
-                continue
-            stat = stats.get(el)
-            num_of_tags = 0
-            num_of_link_tags = 0
-            text_length = 0
-            link_text_length = 0
-            text_density = 0.0
-
-            # the end node
-            if stat is None:
-                __link_els = self.parser.find_all('a', el)
-                __num_of_all_tags = self.parser.count_tag(el, recursive=True)
-                __num_of_text_tags = self.parser.count_tag(el, 'p', recursive=True) + self.parser.count_tag(el, 'br', recursive=True)
-
-                num_of_tags = __num_of_all_tags - __num_of_text_tags
-                num_of_link_tags = len(__link_els)
-                text_length = len(remove_space(self.parser.get_all_text(el)))
-
-                if self.parser.get_tag(el) == 'a':
-                    link_text_length = text_length
-                    num_of_link_tags += 1
-                    text_density = 0.0
-                else:
-                    link_text_length = sum([len(remove_space(self.parser.get_all_text(_el))) for _el in __link_els])
-                    text_density = self.__calculate_text_density(num_of_tags, num_of_link_tags, text_length, link_text_length, body_stat)
+            num_of_tags = __num_of_all_tags - __num_of_text_tags
+            text_length = len(remove_space(self.parser.get_text(el)))
 
+        return num_of_tags, num_of_link_tags, text_length, link_text_length, is_link, tail_text_length
+
+    def __get_fingerprints(self, index, is_leaf):
+        """
+        Subtree fingerprint of each node in preorder, computed from the bottom.
+        An end node hashes its whole subtree, an inner node hashes its tag, attributes, text
+        and the fingerprints (or HTML of the nodes not in the tree) of its children.
+        """
+        fingerprints = [None] * len(self.__nodes)
+        for i in range(len(self.__nodes) - 1, -1, -1):
+            el = self.__nodes[i]
+            h = hashlib.blake2b(digest_size=16)
+            h.update(self.parser.get_tail_text(el).encode())
+            if is_leaf[i]:
+                h.update(b'leaf')
+                h.update(self.parser.get_html(el))
             else:
-                __num_of_all_tags = self.parser.count_tag(el)
-                __num_of_text_tags = self.parser.count_tag(el, 'p') + self.parser.count_tag(el, 'br')
-
-                num_of_tags = __num_of_all_tags - __num_of_text_tags
-                text_length = len(remove_space(self.parser.get_text(el)))
-                text_density = self.__calculate_text_density(
-                    num_of_tags=num_of_tags + stat['num_of_tags'],
-                    num_of_link_tags=stat['num_of_link_tags'],
-                    text_length=text_length + stat['text_length'],
-                    link_text_length=stat['link_text_length'],
-                    body_stat=body_stat,
-                )
-
-            add_stat(el, num_of_tags, num_of_link_tags, text_length, link_text_length, text_density)
-            # Since lxml `el.text` method does not include text following child node, we need to add tail text length to parent node.
-            text_length += len(remove_space(self.parser.get_tail_text(el)))
-            if stat is None:
-                add_stat(parent_el, num_of_tags, num_of_link_tags, text_length, link_text_length, text_density)
-            else:
-                add_stat(
-                    el=parent_el,
-                    num_of_tags=num_of_tags + stat['num_of_tags'],
-                    num_of_link_tags=stat['num_of_link_tags'],
-                    text_length=text_length + stat['text_length'],
-                    link_text_length=stat['link_text_length'],
-                    text_density=text_density,
-                )
-
-        stat_text_density = {el: r['text_density'] for el, r in stats.items()}
-        self.set_node_attributes('text_density', stat_text_density)
-        return stats
-
-    def __calculate_text_density(self, num_of_tags, num_of_link_tags, text_length, link_text_length, body_stat):
-        if text_length == 0 or (text_length - link_text_length) <= 0:
-            return 0.0
-        base = np.log(((text_length/(text_length - link_text_length)) * link_text_length) + (body_stat * text_length) + np.e)
-        M = (text_length/(link_text_length + 1)) * (max(num_of_tags, 1)/max(num_of_link_tags, 1))
-        if M <= 0:
-            return 0.0
-
-        logger.debug(f'text_length={text_length}; link_text_length={link_text_length}; num_of_tags={num_of_tags}; num_of_link_tags={num_of_link_tags}; M={M}; base={base}')
-        return (text_length/max(num_of_tags, 1)) * math.log(M, base)
+                h.update(b'node')
+                h.update(f'{self.parser.get_tag(el)}{sorted(self.parser.get_attrib(el).items())}'.encode())
+                h.update(self.parser.get_text(el).encode())
+                for el_ch in self.parser.iter_children(el):
+                    idx = index.get(el_ch)
+                    if idx is not None:
+                        h.update(fingerprints[idx])
+                    else:
+                        h.update(self.parser.get_html(el_ch))
+                        h.update(self.parser.get_tail_text(el_ch).encode())
+            fingerprints[i] = h.digest()
+        return fingerprints
+
+    def get_fingerprint(self, node):
+        return self.fingerprints[self.__index[node]]
+
+    @property
+    def body_text_length(self):
+        return self.__body_text_length
+
+    def get_node_table(self):
+        """
+        Raw counts of each node in preorder, from which the features can be recomputed without parsing HTML.
+        """
+        table = dict(self.node_counts)
+        table['is_title'] = np.array([node == self.title_el for node in self.__nodes], dtype=bool)
+        return self.__nodes, table
 
     def has_node(self, node):
         return self.__G.has_node(node)
@@ -200,29 +254,14 @@ class DOMTree():
 
         nx.set_node_attributes(self.__G, attrs, 'content')
 
-    def set_distance_from_title(self, text_stats):
-        locs = {}
-        current_loc = 0.0
-        for node in nx.dfs_preorder_nodes(self.__G):
-            locs[node] = current_loc
-            if node == self.title_el:
-                self.title_location = current_loc
-
-            current_loc += np.log(text_stats[node]['text_length'] + np.e)
-
-        if self.title_location is None:
-            self.title_location_auto = (sum(locs.values()) / len(locs)) * PARAM_UNKNOWN_TITLE_LOCATION_RATIO
+    def set_distance_from_title(self):
+        locs = kernel.locations(self.__location_text_length)
+        if self.title_el is not None:
+            self.title_location = locs[self.__index[self.title_el]]
 
-        self.set_node_attributes('location', locs)
-
-    def get_distance_from_title(self, el, location):
-        if self.title_location is not None:
-            diff = location - self.title_location
-            # assign more costs when diff is negative, since content is more likely to appear subsequent to title
-            dist = -diff * PARAM_PRIOR_TITLE_COST if diff < 0 else diff
-            return dist
-        else:
-            return abs(location - self.title_location_auto)
+        title_dist = kernel.distance_from_title(locs, self.title_location, PARAM_PRIOR_TITLE_COST, PARAM_UNKNOWN_TITLE_LOCATION_RATIO)
+        self.set_node_attributes('location', dict(zip(self.__nodes, locs)))
+        self.set_node_attributes('title_dist', dict(zip(self.__nodes, title_dist)))
 
     def iter_nodes(self):
         return self.__G.nodes.items()
@@ -0,0 +1,98 @@
+import logging
+import codecs
+import re
+from collections import namedtuple, Counter
+
+from extractor.util import configure_logging
+
+configure_logging()
+logger = logging.getLogger('applog.' + __name__)
+
+# only the head of the document is scanned for encoding declarations
+PARAM_SNIFF_BYTES = 4096
+DEFAULT_ENCODING = 'utf-8'
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+REGEX_HTTP_CHARSET = re.compile(r'charset\s*=\s*["\']?\s*([\w.:\-]+)', re.IGNORECASE)
+REGEX_META_CHARSET = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([\w.:\-]+)', re.IGNORECASE)
+# Declared labels are resolved to their superset as browsers do (WHATWG Encoding Standard)
+__SUPERSET_ENCODINGS = {
+    'shift_jis': 'cp932',
+    'ascii': 'cp1252',
+    'latin_1': 'cp1252',
+    'iso8859-1': 'cp1252',
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+}
+
+EncodingResult = namedtuple('EncodingResult', ('encoding', 'method'))
+
+# how many documents were resolved by each method: bom, http, meta, detect or default
+detection_counts = Counter()
+
+def normalize_encoding(name):
+    if name is None:
+        return None
+    if isinstance(name, bytes):
+        name = name.decode('ascii', 'ignore')
+    try:
+        encoding = codecs.lookup(name.strip()).name
+    except LookupError:
+        return None
+    return __SUPERSET_ENCODINGS.get(encoding, encoding)
+
+def get_http_charset(content_type):
+    if not content_type:
+        return None
+    m = REGEX_HTTP_CHARSET.search(content_type)
+    return normalize_encoding(m.group(1)) if m else None
+
+def get_meta_charset(html_bytes):
+    m = REGEX_META_CHARSET.search(html_bytes[:PARAM_SNIFF_BYTES])
+    return normalize_encoding(m.group(1)) if m else None
+
+def detect_encoding(html_bytes):
+    """
+    Statistical detection over the whole document. This is the slow path.
+    """
+    try:
+        import chardet
+    except ImportError:
+        return None
+    return normalize_encoding(chardet.detect(html_bytes)['encoding'])
+
+def resolve_encoding(html_bytes, content_type=None):
+    """
+    Resolve the encoding of raw HTML bytes in the order of
+    BOM, HTTP charset and `<meta charset>`, falling back to statistical detection.
+    """
+    result = None
+    for bom, encoding in BOMS:
+        if html_bytes.startswith(bom):
+            result = EncodingResult(encoding, 'bom')
+            break
+
+    if result is None:
+        encoding = get_http_charset(content_type)
+        if encoding is not None:
+            result = EncodingResult(encoding, 'http')
+
+    if result is None:
+        encoding = get_meta_charset(html_bytes)
+        if encoding is not None:
+            result = EncodingResult(encoding, 'meta')
+
+    if result is None:
+        encoding = detect_encoding(html_bytes)
+        if encoding is not None:
+            result = EncodingResult(encoding, 'detect')
+        else:
+            result = EncodingResult(DEFAULT_ENCODING, 'default')
+
+    detection_counts[result.method] += 1
+    logger.debug(f'encoding: {result.encoding} ({result.method})')
+    return result
@@ -0,0 +1,75 @@
+import re
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import HashingVectorizer
+import xgboost as xgb
+
+# estimators pickled into the model, kept apart from `extractor.train` so that loading the model does not import the training stack
+PARAM_HASH_FEATURES = 2 ** 18
+NUMERIC_FEATURES = ('title_dist', 'text_density', 'is_article',)
+
+class Extractor(BaseEstimator, TransformerMixin):
+    def __init__(self, col_name, data_type):
+        self.col_name = col_name
+        self.data_type = data_type
+
+    def transform(self, X):
+        return np.asarray(X[self.col_name]).astype(self.data_type)
+
+    def fit(self, *_):
+        return self
+
+class Apply(BaseEstimator, TransformerMixin):
+    """Apply a function f element-wise to the numpy array
+    """
+    def __init__(self, fn):
+        self.fn = np.vectorize(fn)
+
+    def transform(self, data):
+        return self.fn(data.reshape(data.size, 1))
+
+    def fit(self, *_):
+        return self
+
+def preprocess(attr):
+    attr = attr.replace('_', '-')
+    attr = re.sub('\d+', '0', attr)
+    return attr.lower()
+
+class HashedFeatures(BaseEstimator, TransformerMixin):
+    """Fixed-size feature matrix: hashed char n-grams of attribute names followed by the numeric features.
+    It is stateless, so it can be applied chunk by chunk.
+    Numeric features are not scaled since tree boosters are invariant to scaling.
+    """
+    def __init__(self, n_features=PARAM_HASH_FEATURES):
+        self.n_features = n_features
+
+    @property
+    def n_columns(self):
+        return self.n_features + len(NUMERIC_FEATURES)
+
+    def transform(self, X):
+        ngram_hasher = HashingVectorizer(
+            n_features=self.n_features, ngram_range=(3, 5), analyzer='char', preprocessor=preprocess,
+            alternate_sign=False, norm=None,
+        )
+        attr = ngram_hasher.transform(X['concat_attr_name'].astype(str))
+        numeric = sparse.csr_matrix(np.asarray(X[list(NUMERIC_FEATURES)], dtype=np.float64))
+        features = sparse.hstack([attr, numeric], format='csr')
+        # zeros are treated as missing values in both the svmlight cache and the prediction
+        features.eliminate_zeros()
+        return features
+
+    def fit(self, *_):
+        return self
+
+class HashedModel():
+    """Booster trained by `train_chunked` with the same `predict(df)` interface as the Pipeline model
+    """
+    def __init__(self, featurizer, booster):
+        self.featurizer = featurizer
+        self.booster = booster
+
+    def predict(self, df):
+        return self.booster.predict(xgb.DMatrix(self.featurizer.transform(df)))
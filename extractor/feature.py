@@ -1,17 +1,21 @@
 import logging
-import requests
-import csv
-from collections import namedtuple
+import numpy as np
+import pandas as pd
 
+from extractor import dom as _dom
+from extractor import kernel
 from extractor.dom import DOMTree
-from extractor.util import load_log_config
+from extractor.encoding import resolve_encoding, detection_counts
+from extractor.util import configure_logging
 
-logging.config.dictConfig(load_log_config())
+configure_logging()
 logger = logging.getLogger('applog.' + __name__)
 
 __REMOVE_CLASSES = ('clearfix', 'pc', 'sp',)
 
 SKIP_TAGS = frozenset(['a', 'p', 'br', 'span',])
+FILE_FEATURES = 'data/features.csv'
+FILE_NODE_TABLE = 'data/node_table.csv'
 
 def get_content_related_scores(tree, els):
     score = {}
@@ -50,8 +54,76 @@ def is_skip_tag(tree, node):
     tag = tree.parser.get_tag(node)
     return tag in SKIP_TAGS
 
+def get_node_table(tree, doc_id, url):
+    """
+    Per-document node table: raw counts and labels of every node in preorder.
+    """
+    nodes, table = tree.get_node_table()
+    attrs = dict(tree.get_all_nodes())
+    df = pd.DataFrame(table)
+    df.insert(0, 'doc_id', doc_id)
+    df.insert(1, 'url', url)
+    df.insert(2, 'node_id', range(len(nodes)))
+    df['body_stat'] = tree.body_stat
+    df['attr_name'] = [get_attr_name(tree, node) for node in nodes]
+    df['parent_attr_name'] = [get_attr_name(tree, tree.parser.get_parent(node)) for node in nodes]
+    df['is_article'] = [attrs[node]['is_article'] for node in nodes]
+    df['is_skip'] = [is_skip_tag(tree, node) for node in nodes]
+    df['is_title_candidate'] = [is_title_candidates(tree, node) for node in nodes]
+    # element inside content block
+    df['is_inner_content'] = [attrs[node].get('content', False) and attrs[node]['score'] == 0.0 for node in nodes]
+    df['score'] = [attrs[node]['score'] for node in nodes]
+    return df
+
+def compute_features(node_table):
+    """
+    Derive the features of all documents from the raw counts in the node table without parsing HTML.
+    """
+    missing = [c for c in ('is_leaf', 'tail_text_length') if c not in node_table.columns]
+    if len(missing) > 0:
+        raise ValueError(f'node table without raw counts {missing}, create it again with -t feature')
+    text_density = np.zeros(len(node_table))
+    title_dist = np.zeros(len(node_table))
+    for idx in node_table.groupby('doc_id', sort=False).indices.values():
+        doc = node_table.iloc[idx]
+        parent = doc['parent_id'].values
+        num_of_tags, num_of_link_tags, text_length, link_text_length, location_text_length = kernel.aggregate_counts(
+            parent,
+            doc['is_leaf'].values.astype(bool),
+            doc['num_of_tags'].values,
+            doc['num_of_link_tags'].values,
+            doc['text_length'].values,
+            doc['link_text_length'].values,
+            doc['tail_text_length'].values,
+        )
+        density = kernel.text_density(num_of_tags, num_of_link_tags, text_length, link_text_length, doc['body_stat'].values[0])
+        text_density[idx] = kernel.node_text_density(density, parent, doc['is_link'].values.astype(bool))
+        location = kernel.locations(location_text_length)
+        title_idx = np.flatnonzero(doc['is_title'].values)
+        title_location = location[title_idx[0]] if len(title_idx) > 0 else None
+        title_dist[idx] = kernel.distance_from_title(location, title_location, _dom.PARAM_PRIOR_TITLE_COST, _dom.PARAM_UNKNOWN_TITLE_LOCATION_RATIO)
+
+    features = pd.DataFrame({
+        'attr_name': node_table['attr_name'],
+        'parent_attr_name': node_table['parent_attr_name'],
+        'title_dist': title_dist,
+        'text_density': text_density,
+        'is_article': node_table['is_article'],
+        'score': node_table['score'],
+        'url': node_table['url'],
+    })
+    # ignore elements inside content block, skip tags and title elements
+    is_target = ~(node_table['is_inner_content'] | node_table['is_skip'] | node_table['is_title_candidate'])
+    return features[is_target.values].drop_duplicates()
+
+def recompute_features(path):
+    compute_features(pd.read_csv(path, float_precision='round_trip')).to_csv(FILE_FEATURES, index=False)
+    logger.info('save result.')
+
 def get_feature(data):
-    features = []
+    # requests is only needed for feature creation, not for extraction
+    import requests
+    node_tables = []
     for i, d in enumerate(data, 1):
         logger.info(f"{d['url']}, {d['path']}")
         if i % 10 == 0:
@@ -68,12 +140,12 @@ def get_feature(data):
             logger.warn(e)
             continue
 
-        res.encoding = res.apparent_encoding
+        encoding, _ = resolve_encoding(res.content, res.headers.get('content-type'))
         parser_type = 'lxml' if d['path'].startswith('/') else 'soup'
-        html = res.content if d['path'].startswith('/') else res.text
+        html = res.content if d['path'].startswith('/') else res.content.decode(encoding, 'replace')
 
         try:
-            tree = DOMTree(parser_type, html)
+            tree = DOMTree(parser_type, html, encoding)
         except Exception as e:
             logger.warn(e)
             continue
@@ -94,44 +166,15 @@ def get_feature(data):
 
         tree.set_node_attributes('content', content_attrs)
 
-        feature = namedtuple('featues', ('attr_name', 'parent_attr_name', 'title_dist', 'text_density', 'is_article', 'score'))
-        for node, attr in tree.iter_nodes():
-            # ignore element inside content block
-            if 'content' in attr and attr['score'] == 0.0:
-                continue
-
-            if is_skip_tag(tree, node):
-                continue
-
-            # ignore title element
-            if is_title_candidates(tree, node):
-                continue
-
-            # get attribute of the element
-            attr_name = get_attr_name(tree, node)
-
-            # get attribute of the parent element
-            parent_node = tree.parser.get_parent(node)
-            parent_attr_name = get_attr_name(tree, parent_node)
-
-            f = feature(
-                attr_name=attr_name,
-                parent_attr_name=parent_attr_name,
-                title_dist=tree.get_distance_from_title(node, attr['location']),
-                text_density=attr.get('text_density', 0.0),
-                is_article=attr['is_article'],
-                score=attr['score'],
-            )
-            logger.debug(f)
-            features.append(f)
-
-    mode = 'w'
-    with open('data/features.csv', mode) as f:
-        w = csv.writer(f)
-        if mode == 'w':
-            header = features[0]._fields
-            w.writerow(header)
-        for f in set(features):
-            w.writerow(list(f))
+        node_tables.append(get_node_table(tree, doc_id=i, url=d['url']))
+
+    if len(node_tables) == 0:
+        logger.warn('there are no documents')
+        return
+
+    node_table = pd.concat(node_tables, ignore_index=True)
+    node_table.to_csv(FILE_NODE_TABLE, index=False)
+    compute_features(node_table).to_csv(FILE_FEATURES, index=False)
 
     logger.info('save result.')
+    logger.info(f'encoding resolved by: {dict(detection_counts)}')
@@ -0,0 +1,40 @@
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from extractor.util import configure_logging
+
+configure_logging()
+logger = logging.getLogger('applog.' + __name__)
+
+PARAM_MAX_URLS = 1000
+
+# fingerprint of the whole page, raw counts and (feature, score) by subtree fingerprint, and the result of the last extraction
+Entry = namedtuple('Entry', ('page_fingerprint', 'counts', 'scores', 'result'))
+
+class FingerprintStore():
+    """
+    Per-URL subtree fingerprints of the last extraction, bounded by the number of URLs.
+    The least recently used URL is evicted first.
+    """
+    def __init__(self, max_urls=PARAM_MAX_URLS):
+        self.max_urls = max_urls
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url, entry):
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_urls:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,171 @@
+"""
+Array kernels of the DOM features.
+Every array holds one value per node in DFS preorder, `parent` is the index of the parent node (-1 for the root).
+"""
+import math
+import numpy as np
+
+# `np.log` may differ from libm in the last bit, use `math.log` element-wise where the original formula did
+_math_log = np.frompyfunc(math.log, 1, 1)
+
+def depths(parent):
+    """
+    Depth of each node, the root is 0.
+    """
+    depth = np.zeros(len(parent), dtype=np.int64)
+    ancestor = parent.copy()
+    has_ancestor = ancestor >= 0
+    while has_ancestor.any():
+        depth[has_ancestor] += 1
+        ancestor[has_ancestor] = parent[ancestor[has_ancestor]]
+        has_ancestor = ancestor >= 0
+    return depth
+
+def aggregate_counts(parent, is_leaf, num_of_tags, num_of_link_tags, text_length, link_text_length, tail_text_length):
+    """
+    Aggregate counts of each node from the bottom of the tree, one depth level at a time.
+    Counts of a leaf node cover its whole subtree, counts of an inner node cover the node itself.
+    Inner nodes pass their own tag count and text length up twice, as the original accumulation did.
+
+    Returns the aggregated counts used for text density
+    and the text length used for location (the root counts itself twice).
+    """
+    own = np.stack([num_of_tags, num_of_link_tags, text_length, link_text_length], axis=1).astype(np.float64)
+    tail = np.zeros_like(own)
+    tail[:, 2] = tail_text_length
+    is_inner = ~np.asarray(is_leaf)
+
+    children = np.zeros_like(own)
+    depth = depths(parent)
+    for d in range(depth.max(), 0, -1):
+        idx = np.flatnonzero(depth == d)
+        contrib = own[idx] + is_inner[idx, None] * (own[idx] + children[idx]) + tail[idx]
+        np.add.at(children, parent[idx], contrib)
+
+    aggregated = own + children
+    location_text_length = aggregated[:, 2].copy()
+    is_root = parent < 0
+    location_text_length[is_root] += (own + is_inner[:, None] * aggregated + tail)[is_root, 2]
+    return aggregated[:, 0], aggregated[:, 1], aggregated[:, 2], aggregated[:, 3], location_text_length
+
+def text_density(num_of_tags, num_of_link_tags, text_length, link_text_length, body_stat):
+    """
+    Text density of each node computed from its aggregated counts.
+    `body_stat` is the link text ratio of the whole body, a scalar or an array.
+    """
+    num_of_tags = np.asarray(num_of_tags, dtype=np.float64)
+    num_of_link_tags = np.asarray(num_of_link_tags, dtype=np.float64)
+    text_length = np.asarray(text_length, dtype=np.float64)
+    link_text_length = np.asarray(link_text_length, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = (text_length != 0) & ((text_length - link_text_length) > 0)
+        base = np.log(((text_length/(text_length - link_text_length)) * link_text_length) + (body_stat * text_length) + np.e)
+        M = (text_length/(link_text_length + 1)) * (np.maximum(num_of_tags, 1)/np.maximum(num_of_link_tags, 1))
+        valid &= M > 0
+        M = np.where(valid, M, 1.0)
+        base = np.where(valid, base, np.e)
+        log_M = _math_log(M).astype(np.float64)
+        log_base = _math_log(base).astype(np.float64)
+        density = (text_length/np.maximum(num_of_tags, 1)) * (log_M / log_base)
+    return np.where(valid, density, 0.0)
+
+def sum_children(values, parent):
+    """
+    Sum of the values of the direct children of each node.
+    """
+    total = np.zeros(len(values), dtype=np.float64)
+    has_parent = parent >= 0
+    np.add.at(total, parent[has_parent], values[has_parent])
+    return total
+
+def node_text_density(density, parent, is_link):
+    """
+    `text_density` node attribute: the density of the node plus the densities of its direct children.
+    Link nodes have no density of their own, and the root adds its own density twice.
+    """
+    density = np.where(is_link, 0.0, density)
+    total = sum_children(density, parent) + density
+    is_root = parent < 0
+    total[is_root] += density[is_root]
+    return total
+
+def locations(text_length):
+    """
+    Location of each node: the sum of log text lengths of the preceding nodes in preorder.
+    """
+    cumsum = np.cumsum(np.log(np.asarray(text_length, dtype=np.float64) + np.e))
+    return np.concatenate([[0.0], cumsum[:-1]])
+
+def distance_from_title(location, title_location, prior_title_cost, unknown_title_location_ratio):
+    """
+    Distance of each node from the title, nodes preceding the title cost `prior_title_cost` times more.
+    When the title is unknown, the distance is taken from a location relative to the mean location.
+    """
+    if title_location is not None:
+        diff = location - title_location
+        return np.where(diff < 0, -diff * prior_title_cost, diff)
+    title_location_auto = (np.cumsum(location)[-1] / len(location)) * unknown_title_location_ratio
+    return np.abs(location - title_location_auto)
+
+# a small page (a header of links, a title, an article and a footer) and the outputs of the original implementation,
+# the kernels must reproduce them exactly so that the features do not change silently
+_REFERENCE = {
+    'parent': [-1, 0, 1, 1, 1, 0, 5, 5, 7, 7, 9, 7, 5, 12, 13, 12, 0],
+    'is_leaf': [0, 0, 1, 1, 1, 0, 1, 0, 1, 0, 1, 1, 0, 0, 1, 1, 1],
+    'num_of_tags': [3, 3, 0, 0, 0, 3, 0, 0, 0, 1, 0, 0, 2, 1, 0, 0, 1],
+    'num_of_link_tags': [0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0],
+    'text_length': [0, 0, 4, 7, 4, 0, 11, 0, 40, 10, 5, 4, 0, 0, 10, 13, 16],
+    'link_text_length': [0, 0, 4, 7, 0, 0, 0, 0, 0, 0, 5, 0, 0, 0, 10, 0, 0],
+    'tail_text_length': [0, 0, 1, 0, 0, 0, 0, 0, 8, 0, 7, 4, 0, 0, 0, 0, 0],
+    'is_link': [0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0],
+    'body_stat': 0.18571428571428572,
+    'title_idx': 6,
+    'prior_title_cost': 5,
+    'unknown_title_location_ratio': 0.2,
+    'text_density': [
+        146.30959262910102, 28.44402239010771, 0.0, 0.0, 25.624779342726637, 229.1643373073563,
+        59.27409540968752, 359.3518561643874, 175.5890465116172, 30.086924315881447, 0.0, 25.624779342726637,
+        78.25351524737533, 0.0, 0.0, 67.77120687775421, 80.20298391697648,
+    ],
+    'location': [
+        0.0, 5.7388866554418785, 8.668387339611252, 10.573219781165701, 12.847228617393549,
+        14.752061058947998, 19.578118507371542, 22.196847890665328, 26.704606791184766, 30.459233765656606,
+        33.666776890509254, 35.71036866869511, 37.61520111024956, 40.86240320445051, 43.405443676859846,
+        45.94848414926918, 48.70330863185265,
+    ],
+    'title_dist': [
+        97.89059253685771, 69.19615925964833, 54.54865583880145, 45.0244936310292, 33.65444944988997,
+        24.13028724211772, 0.0, 2.618729383293786, 7.126488283813224, 10.881115258285064, 14.088658383137712,
+        16.13225016132357, 18.037082602878016, 21.284284697078967, 23.827325169488304, 26.370365641897635,
+        29.125190124481108,
+    ],
+    'title_dist_unknown': [
+        5.146242079286173, 0.5926445761557053, 3.522145260325079, 5.426977701879528, 7.700986538107376,
+        9.605818979661825, 14.431876428085369, 17.050605811379157, 21.55836471189859, 25.31299168637043,
+        28.52053481122308, 30.564126589408936, 32.46895903096338, 35.716161125164334, 38.25920159757367,
+        40.802242069983, 43.557066552566475,
+    ],
+}
+
+def check():
+    """
+    Run the kernels on the reference page and raise RuntimeError naming the outputs that differ.
+    """
+    ref = {k: np.array(v) if isinstance(v, list) else v for k, v in _REFERENCE.items()}
+    parent = ref['parent'].astype(np.int64)
+    is_link = ref['is_link'].astype(bool)
+    num_of_tags, num_of_link_tags, text_length, link_text_length, location_text_length = aggregate_counts(
+        parent, ref['is_leaf'].astype(bool), ref['num_of_tags'], ref['num_of_link_tags'], ref['text_length'],
+        ref['link_text_length'], ref['tail_text_length'])
+    density = text_density(num_of_tags, num_of_link_tags, text_length, link_text_length, ref['body_stat'])
+    location = locations(location_text_length)
+    outputs = {
+        'text_density': node_text_density(density, parent, is_link),
+        'location': location,
+        'title_dist': distance_from_title(location, location[ref['title_idx']], ref['prior_title_cost'], ref['unknown_title_location_ratio']),
+        'title_dist_unknown': distance_from_title(location, None, ref['prior_title_cost'], ref['unknown_title_location_ratio']),
+    }
+    mismatched = [name for name, values in outputs.items() if not np.array_equal(values, ref[name])]
+    if len(mismatched) > 0:
+        raise RuntimeError(f'kernel outputs differ from the reference: {mismatched}')
@@ -0,0 +1,304 @@
+import logging
+import json
+import os
+import random
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from extractor.util import configure_logging
+
+configure_logging()
+logger = logging.getLogger('applog.' + __name__)
+
+DIR_LOADTEST = 'data/loadtest'
+FILE_GUNICORN_CONF = 'gunicorn_conf.py'
+# a port apart from the one in gunicorn_conf.py, so that a running server is not hit
+PARAM_BIND = '127.0.0.1:5055'
+PARAM_CONCURRENCY = 4
+PARAM_DURATION = 60
+# worker timeout of gunicorn when neither `--timeout` nor gunicorn_conf.py sets it
+PARAM_SERVER_TIMEOUT = 30
+# the client waits this many seconds longer than the worker timeout,
+# so that a request running too long is killed by gunicorn rather than given up by the client
+PARAM_REQUEST_TIMEOUT_MARGIN = 10
+PARAM_STARTUP_TIMEOUT = 120
+# seconds between RSS samples of the workers
+PARAM_RSS_INTERVAL = 1.0
+PERCENTILES = (50, 90, 99)
+
+def start_server(bind=PARAM_BIND, workers=None, threads=None, timeout=None):
+    """
+    Start gunicorn with `gunicorn_conf.py`, overriding `bind`, `workers`, `threads` and `timeout`.
+    """
+    cmd = [sys.executable, '-m', 'gunicorn', '-c', FILE_GUNICORN_CONF, '-b', bind]
+    if workers is not None:
+        cmd += ['-w', str(workers)]
+    if threads is not None:
+        cmd += ['--threads', str(threads)]
+    if timeout is not None:
+        cmd += ['-t', str(timeout)]
+    cmd.append('server:app')
+    logger.info(' '.join(cmd))
+    return subprocess.Popen(cmd, env=os.environ)
+
+def get_server_timeout(timeout=None):
+    """
+    Worker timeout of the server started with `timeout`, falling back to gunicorn_conf.py.
+    """
+    if timeout is not None:
+        return timeout
+    return runpy.run_path(FILE_GUNICORN_CONF).get('timeout', PARAM_SERVER_TIMEOUT)
+
+def wait_healthy(base_url, proc, timeout=PARAM_STARTUP_TIMEOUT):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with {proc.returncode}')
+        try:
+            with urllib.request.urlopen(f'{base_url}/healthcheck', timeout=1) as res:
+                if res.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'server did not start in {timeout} seconds')
+
+def stop_server(proc):
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(PARAM_STARTUP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def get_worker_pids(master_pid):
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name in parentheses may contain spaces
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        if ppid == master_pid:
+            pids.append(int(name))
+    return sorted(pids)
+
+def get_rss(pid):
+    """
+    Resident set size of a process in bytes, None when it has exited.
+    """
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class RSSSampler(threading.Thread):
+    """
+    Sample the RSS of the master and the workers, following workers restarted by gunicorn.
+    """
+    def __init__(self, master_pid, interval=PARAM_RSS_INTERVAL):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while not self._done.is_set():
+            workers = {pid: get_rss(pid) for pid in get_worker_pids(self.master_pid)}
+            self.samples.append({
+                'elapsed': round(time.perf_counter() - start, 3),
+                'master': get_rss(self.master_pid),
+                'workers': {str(pid): r for pid, r in workers.items() if r is not None},
+            })
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+def post_html(url, html, timeout=PARAM_SERVER_TIMEOUT + PARAM_REQUEST_TIMEOUT_MARGIN):
+    """
+    POST raw HTML to /extract/body, and return 'ok', 'error' or 'timeout'.
+    A connection reset counts as 'timeout', since gunicorn closes the connection when it kills a worker on timeout.
+    """
+    req = urllib.request.Request(url, data=html, headers={'Content-Type': 'text/html'}, method='POST')
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as res:
+            body = json.loads(res.read())
+    # RemoteDisconnected is a ConnectionResetError
+    except (socket.timeout, ConnectionResetError):
+        return 'timeout'
+    except urllib.error.URLError as e:
+        return 'timeout' if isinstance(e.reason, (socket.timeout, ConnectionResetError)) else 'error'
+    except Exception:
+        return 'error'
+    return 'ok' if 'content' in body else 'error'
+
+def run_load(url, htmls, concurrency=PARAM_CONCURRENCY, rate=None, duration=PARAM_DURATION, timeout=PARAM_SERVER_TIMEOUT + PARAM_REQUEST_TIMEOUT_MARGIN):
+    """
+    Replay `htmls` in a cycle for `duration` seconds.
+    Without `rate`, `concurrency` clients send requests back to back (closed loop).
+    With `rate`, requests arrive as a Poisson process of `rate` per second regardless of the responses (open loop),
+    and the latency includes the wait for a free client.
+    """
+    results = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def send(idx, scheduled):
+        status = post_html(url, htmls[idx % len(htmls)], timeout)
+        end = time.perf_counter()
+        with lock:
+            results.append((scheduled - start, end - scheduled, status))
+
+    if rate is None:
+        counter = iter(range(sys.maxsize))
+
+        def client():
+            while time.perf_counter() - start < duration:
+                with lock:
+                    idx = next(counter)
+                send(idx, time.perf_counter())
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        with ThreadPoolExecutor(concurrency) as executor:
+            scheduled = start
+            idx = 0
+            while True:
+                scheduled += random.expovariate(rate)
+                if scheduled - start >= duration:
+                    break
+                time.sleep(max(scheduled - time.perf_counter(), 0))
+                executor.submit(send, idx, scheduled)
+                idx += 1
+
+    return results, time.perf_counter() - start
+
+def summarize(results, elapsed, rss_samples):
+    latencies = np.array([latency for _, latency, status in results if status == 'ok'])
+    statuses = [status for _, _, status in results]
+    num_of_requests = len(results)
+    report = {
+        'requests': num_of_requests,
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'error_rate': statuses.count('error') / max(num_of_requests, 1),
+        'timeout_rate': statuses.count('timeout') / max(num_of_requests, 1),
+        'latency': {
+            f'p{p}': float(np.percentile(latencies, p)) if len(latencies) > 0 else None for p in PERCENTILES
+        },
+    }
+    report['latency']['max'] = float(latencies.max()) if len(latencies) > 0 else None
+
+    # per worker, since gunicorn restarts a worker after a timeout
+    rss = {}
+    for sample in rss_samples:
+        for pid, r in sample['workers'].items():
+            rss[pid] = max(rss.get(pid, 0), r)
+    report['max_rss'] = {
+        'master': max([s['master'] or 0 for s in rss_samples], default=0),
+        'workers': rss,
+    }
+    return report
+
+def loadtest(corpus, workers=None, threads=None, timeout=None, concurrency=PARAM_CONCURRENCY, rate=None, duration=PARAM_DURATION):
+    """
+    Start the server locally, replay the HTML files in `corpus` against /extract/body and save the report
+    to data/loadtest/<timestamp>.json.
+    """
+    paths = sorted(os.path.join(d, f) for d, _, files in os.walk(corpus) for f in files if f.endswith('.html'))
+    if len(paths) == 0:
+        raise ValueError(f'no html in {corpus}')
+    htmls = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            htmls.append(f.read())
+
+    base_url = f'http://{PARAM_BIND}'
+    request_timeout = get_server_timeout(timeout) + PARAM_REQUEST_TIMEOUT_MARGIN
+    proc = start_server(PARAM_BIND, workers, threads, timeout)
+    try:
+        startup = wait_healthy(base_url, proc)
+        sampler = RSSSampler(proc.pid)
+        sampler.start()
+        try:
+            results, elapsed = run_load(f'{base_url}/extract/body', htmls, concurrency, rate, duration, request_timeout)
+        finally:
+            sampler.stop()
+    finally:
+        stop_server(proc)
+
+    report = {
+        'config': {
+            'corpus': corpus,
+            'docs': len(htmls),
+            'workers': workers,
+            'threads': threads,
+            'timeout': timeout,
+            'request_timeout': request_timeout,
+            'concurrency': concurrency,
+            'rate': rate,
+            'duration': duration,
+        },
+        'startup': startup,
+    }
+    report.update(summarize(results, elapsed, sampler.samples))
+    report['rss'] = sampler.samples
+    report['requests_log'] = [
+        {'sent': round(sent, 4), 'latency': round(latency, 4), 'status': status} for sent, latency, status in results
+    ]
+
+    os.makedirs(DIR_LOADTEST, exist_ok=True)
+    path = os.path.join(DIR_LOADTEST, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"throughput={round(report['throughput'], 2)}/s; latency={report['latency']}; "
+                f"error_rate={report['error_rate']}; timeout_rate={report['timeout_rate']}; saved to {path}")
+    return report
+
+def compare(path_base, path_new):
+    """
+    Compare two saved reports by throughput, latency percentiles, error rates and max RSS of a worker.
+    """
+    reports = []
+    for path in (path_base, path_new):
+        with open(path, 'r') as f:
+            reports.append(json.load(f))
+    base, new = reports
+
+    def max_worker_rss(report):
+        return max(report['max_rss']['workers'].values(), default=0)
+
+    rows = [('throughput', base['throughput'], new['throughput'])]
+    rows += [(f'latency {k}', base['latency'][k], new['latency'][k]) for k in base['latency']]
+    rows += [(k, base[k], new[k]) for k in ('error_rate', 'timeout_rate')]
+    rows.append(('max worker rss', max_worker_rss(base), max_worker_rss(new)))
+
+    for name, b, n in rows:
+        change = f'{round((n - b) / b * 100, 1)}%' if b and n is not None else '-'
+        logger.info(f'{name:>14}: {b} -> {n} ({change})')
+    return rows
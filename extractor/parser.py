@@ -1,14 +1,12 @@
 import logging
 import lxml.html
 from lxml.html.clean import Cleaner
-from bs4 import BeautifulSoup
-from bs4.element import Tag
 import re
-from readability import htmls
 
-from extractor.util import load_log_config
+from extractor.encoding import resolve_encoding
+from extractor.util import configure_logging
 
-logging.config.dictConfig(load_log_config())
+configure_logging()
 logger = logging.getLogger('applog.' + __name__)
 
 # Handle jQuery Lazy Load Plugin
@@ -24,9 +22,9 @@ class Parser():
     __REGEX_TITLE_ATTR = re.compile('title', re.IGNORECASE)
     __REGEX_NOT_TITLE_ATTR = re.compile('sub|side|related', re.IGNORECASE)
 
-    def __init__(self, type_='lxml', html_string=''):
+    def __init__(self, type_='lxml', html_string='', encoding=None, content_type=None):
         if type_ == 'lxml':
-            self._parser = LxmlParser(html_string)
+            self._parser = LxmlParser(html_string, encoding, content_type)
         elif type_ == 'soup':
             self._parser = SoupParser(html_string)
         else:
@@ -67,6 +65,12 @@ class Parser():
             return []
         return self._parser.get_attrs(el)
 
+    def get_attrib(self, el):
+        return self._parser.get_attrib(el)
+
+    def get_html(self, el):
+        return self._parser.get_html(el)
+
     def get_parent_attrs(self, el):
         parent = self._parser.get_parent(el)
         return self.get_attrs(parent)
@@ -112,9 +116,21 @@ class Parser():
         return image_urls
 
 class LxmlParser():
-    def __init__(self, html_string):
-        # use readability `build_doc` func to avoid encoding error
-        self.html, _ = htmls.build_doc(html_string)
+    def __init__(self, html_string, encoding=None, content_type=None):
+        """
+        Without `encoding`, the encoding of bytes is resolved from the BOM, the charset in `content_type`
+        (the HTTP Content-Type header), <meta charset> or detection.
+        """
+        self.encoding = encoding
+        self.encoding_method = None
+        if isinstance(html_string, bytes):
+            if self.encoding is None:
+                self.encoding, self.encoding_method = resolve_encoding(html_string, content_type)
+            self.html = self.build_doc(html_string, self.encoding)
+        else:
+            # use readability `build_doc` func to avoid encoding error
+            from readability import htmls
+            self.html, _ = htmls.build_doc(html_string)
         self.title = self.get_title(self.html)
         # Use self.html when self.html.body does not exist
         try:
@@ -125,6 +141,22 @@ class LxmlParser():
 
         self.prepend_newline()
 
+    def build_doc(self, html_bytes, encoding):
+        """
+        Pass bytes straight to lxml with the resolved encoding.
+        Decode in Python only when libxml2 does not know the encoding.
+        """
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding.replace('_', '-'))
+        except LookupError:
+            parser = None
+
+        if parser is not None:
+            return lxml.html.document_fromstring(html_bytes, parser=parser)
+        from readability import htmls
+        html, _ = htmls.build_doc(html_bytes.decode(encoding, 'replace'))
+        return html
+
     # https://stackoverflow.com/questions/18660382/how-can-i-preserve-br-as-newlines-with-lxml-html-text-content-or-equivalent
     def prepend_newline(self):
         for br in self.body.xpath('*//br'):
@@ -184,6 +216,12 @@ class LxmlParser():
             attrs.extend(attrib['class'].split())
         return attrs
 
+    def get_attrib(self, el):
+        return dict(el.attrib)
+
+    def get_html(self, el):
+        return lxml.html.tostring(el, with_tail=False)
+
     def get_parent(self, el):
         return el.getparent()
 
@@ -209,6 +247,8 @@ class LxmlParser():
 
 class SoupParser():
     def __init__(self, html_string):
+        # bs4 is only used for feature creation, so it is imported lazily
+        from bs4 import BeautifulSoup
         self.html = BeautifulSoup(html_string, 'lxml')
         self.title = self.get_title(self.html)
         self.body = self.html.body
@@ -240,6 +280,12 @@ class SoupParser():
     def get_tag(self, el):
         return el.name
 
+    def get_attrib(self, el):
+        return {k: ' '.join(v) if isinstance(v, list) else v for k, v in el.attrs.items()}
+
+    def get_html(self, el):
+        return str(el).encode()
+
     def get_parent(self, el):
         return el.find_parent()
 
@@ -256,6 +302,7 @@ class SoupParser():
         return attrs
 
     def iter_children(self, el):
+        from bs4.element import Tag
         return [ch for ch in el.children if isinstance(ch, Tag)]
 
     def iter_ancestors(self, el):
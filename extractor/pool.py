@@ -0,0 +1,147 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import multiprocessing
+
+from extractor.content_extractor import extract
+from extractor.util import configure_logging, load_model, FILE_MODEL
+
+configure_logging()
+logger = logging.getLogger('applog.' + __name__)
+
+# recycle a worker after this many documents to limit lxml memory fragmentation
+PARAM_MAX_TASKS_PER_WORKER = 500
+# number of documents held in shared memory per worker at a time
+PARAM_MAX_PENDING_PER_WORKER = 4
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# model loaded once per worker process by `_init_worker`
+_model = None
+
+def _init_worker(model_path):
+    global _model
+    _model = load_model(model_path)
+
+def _extract_shared(task):
+    idx, path, encoding = task
+    try:
+        with open(path, 'rb') as f:
+            html = f.read()
+        return idx, extract(_model, html, encoding=encoding)
+    except Exception as e:
+        logger.warn(f'{idx}: {repr(e)}')
+        return idx, {'error': repr(e)}
+
+def _write_shared(html):
+    """
+    Write HTML bytes to a shared memory (tmpfs) buffer, so that the document is not pickled.
+    """
+    fd, path = tempfile.mkstemp(prefix='extract-', suffix='.html', dir=SHM_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(html)
+    return path
+
+class ExtractionPool():
+    """
+    Extract contents in worker processes preloaded with the model.
+
+    usage:
+        with ExtractionPool(processes=4) as pool:
+            for idx, result in pool.imap(htmls):
+                ...
+    """
+    def __init__(self, model_path=FILE_MODEL, processes=None, max_tasks_per_worker=PARAM_MAX_TASKS_PER_WORKER):
+        self.processes = processes or os.cpu_count()
+        self._pool = multiprocessing.Pool(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(model_path,),
+            maxtasksperchild=max_tasks_per_worker,
+        )
+
+    def imap(self, htmls, ordered=True):
+        """
+        Yield (index, result) for each HTML document.
+        Results are yielded in input order when `ordered` is True, otherwise as they complete.
+        `str` documents are encoded to UTF-8, `bytes` documents are passed to the parser as is.
+        """
+        slots = threading.BoundedSemaphore(self.processes * PARAM_MAX_PENDING_PER_WORKER)
+        paths = {}
+        # shared between the consumer and the task handler thread, so that no file is written after cleanup
+        lock = threading.Lock()
+        stopped = threading.Event()
+
+        # consumed by the task handler thread of the pool
+        def tasks():
+            for idx, html in enumerate(htmls):
+                encoding = None
+                if isinstance(html, str):
+                    html = html.encode('utf-8')
+                    encoding = 'utf-8'
+                slots.acquire()
+                with lock:
+                    if stopped.is_set():
+                        return
+                    paths[idx] = _write_shared(html)
+                yield idx, paths[idx], encoding
+
+        imap = self._pool.imap if ordered else self._pool.imap_unordered
+        try:
+            for idx, result in imap(_extract_shared, tasks()):
+                with lock:
+                    os.unlink(paths.pop(idx))
+                slots.release()
+                yield idx, result
+        finally:
+            with lock:
+                stopped.set()
+                for path in paths.values():
+                    os.unlink(path)
+                paths.clear()
+            # wake up the producer blocked on a slot, so that it sees `stopped` and returns
+            try:
+                slots.release()
+            except ValueError:
+                pass
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.terminate()
+
+def benchmark(htmls, model_path=FILE_MODEL, max_processes=None):
+    """
+    Measure throughput of `ExtractionPool` from 1 to `max_processes` workers.
+    """
+    max_processes = max_processes or os.cpu_count()
+    results = []
+    for processes in range(1, max_processes + 1):
+        with ExtractionPool(model_path, processes) as pool:
+            # exclude worker boot and model loading from the measurement
+            list(pool.imap(htmls[:processes]))
+            start = time.perf_counter()
+            for _ in pool.imap(htmls, ordered=False):
+                pass
+            elapsed = time.perf_counter() - start
+
+        docs_per_sec = len(htmls) / elapsed
+        speedup = docs_per_sec / results[0]['docs_per_sec'] if len(results) > 0 else 1.0
+        results.append({
+            'processes': processes,
+            'elapsed': elapsed,
+            'docs_per_sec': docs_per_sec,
+            'speedup': speedup,
+        })
+        logger.info(f'processes={processes}; docs/sec={round(docs_per_sec, 2)}; speedup={round(speedup, 2)}')
+    return results
@@ -0,0 +1,57 @@
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+
+from extractor.util import configure_logging
+
+configure_logging()
+logger = logging.getLogger('applog.' + __name__)
+
+# seconds from interpreter start until the serving module is imported and the model is loaded
+PARAM_COLD_START_TARGET = 1.5
+REGEX_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+def profile_startup(module='server', top=20):
+    """
+    Import `module` in a fresh interpreter with `-X importtime` and report the slowest imports.
+    """
+    code = f'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=os.environ,
+    )
+    cold_start = time.perf_counter() - start
+    if proc.returncode != 0:
+        logger.error(proc.stderr)
+        raise RuntimeError(f'failed to import {module}')
+    import_time = float(proc.stdout.strip().splitlines()[-1])
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        m = REGEX_IMPORT_TIME.match(line)
+        if m is None:
+            continue
+        self_us, cumulative_us, indent, name = m.groups()
+        imports.append({
+            'name': name,
+            'depth': len(indent) // 2,
+            'self': int(self_us) / 1e6,
+            'cumulative': int(cumulative_us) / 1e6,
+        })
+
+    for r in sorted(imports, key=lambda r: r['cumulative'], reverse=True)[:top]:
+        logger.info(f"{round(r['cumulative'], 3):>8}s {round(r['self'], 3):>8}s {'  ' * r['depth']}{r['name']}")
+
+    report = {
+        'module': module,
+        'cold_start': cold_start,
+        'import_time': import_time,
+        'target': PARAM_COLD_START_TARGET,
+        'ok': cold_start <= PARAM_COLD_START_TARGET,
+    }
+    logger.info(f'startup report: {report}')
+    return report
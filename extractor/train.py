@@ -1,55 +1,129 @@
 import logging
-import re
+import os
+import io
+import zlib
 import csv
 import numpy as np
 import dill
 import pandas as pd
+from sklearn.datasets import dump_svmlight_file, load_svmlight_file
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error
-from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline, FeatureUnion
 import xgboost as xgb
 
-from extractor.util import load_log_config
+from extractor.estimator import Extractor, Apply, HashedFeatures, HashedModel, preprocess
+from extractor.util import configure_logging
 
-logging.config.dictConfig(load_log_config())
+configure_logging()
 logger = logging.getLogger('applog.' + __name__)
 
 dill.settings['recurse'] = True
 
-class Extractor(BaseEstimator, TransformerMixin):
-    def __init__(self, col_name, data_type):
-        self.col_name = col_name
-        self.data_type = data_type
+FILE_MODEL = 'data/model.pkl'
+DIR_CACHE = 'data/cache'
+PARAM_CHUNK_SIZE = 100000
+PARAM_TEST_SIZE = 0.2
+PARAM_NUM_BOOST_ROUND = 400
+PARAM_BOOSTER = {
+    'objective': 'reg:squarederror',
+    'eta': 0.1,
+    'max_depth': 3,
+    'min_child_weight': 3,
+}
 
-    def transform(self, X):
-        return np.asarray(X[self.col_name]).astype(self.data_type)
+def prepare(df):
+    df = df.fillna({'title_dist': 0.0})
+    df['concat_attr_name'] = df['attr_name'].str.cat(df['parent_attr_name'], sep='|')
+    return df
 
-    def fit(self, *_):
-        return self
+def iter_svmlight(path, n_features, chunksize=PARAM_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        while True:
+            lines = [line for _, line in zip(range(chunksize), f)]
+            if len(lines) == 0:
+                break
+            yield load_svmlight_file(io.BytesIO(b''.join(lines)), n_features=n_features, zero_based=True)
 
-class Apply(BaseEstimator, TransformerMixin):
-    """Apply a function f element-wise to the numpy array
+def external_memory_dmatrix(path, n_features, chunksize=PARAM_CHUNK_SIZE):
     """
-    def __init__(self, fn):
-        self.fn = np.vectorize(fn)
+    DMatrix which keeps the training data on disk.
+    Newer XGBoost only accepts an iterator for external memory, older versions read the svmlight file with a cache.
+    """
+    cache_prefix = f'{path}.cache'
+    if not hasattr(xgb, 'DataIter'):
+        return xgb.DMatrix(f'{path}#{cache_prefix}')
+
+    class SvmlightIter(xgb.DataIter):
+        def __init__(self):
+            self._chunks = None
+            super().__init__(cache_prefix=cache_prefix)
+
+        def next(self, input_data):
+            if self._chunks is None:
+                self._chunks = iter_svmlight(path, n_features, chunksize)
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            X, y = chunk
+            input_data(data=X, label=y)
+            return True
 
-    def transform(self, data):
-        return self.fn(data.reshape(data.size, 1))
+        def reset(self):
+            self._chunks = None
 
-    def fit(self, *_):
-        return self
+    return xgb.DMatrix(SvmlightIter())
+
+def train_chunked(path, chunksize=PARAM_CHUNK_SIZE):
+    """
+    Train the model streaming the features file, so that peak memory does not grow with the corpus.
+    """
+    featurizer = HashedFeatures()
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    train_path = os.path.join(DIR_CACHE, 'train.svm')
+    test_path = os.path.join(DIR_CACHE, 'test.svm')
 
-def preprocess(attr):
-    attr = attr.replace('_', '-')
-    attr = re.sub('\d+', '0', attr)
-    return attr.lower()
+    rng = np.random.RandomState(0)
+    with open(train_path, 'wb') as f_train, open(test_path, 'wb') as f_test:
+        for i, chunk in enumerate(pd.read_csv(path, chunksize=chunksize), 1):
+            chunk = prepare(chunk)
+            X = featurizer.transform(chunk)
+            y = chunk['score'].values
+            if 'url' in chunk:
+                # split by article so that nodes of one page do not leak across the split
+                is_test = np.array([zlib.crc32(url.encode()) % 100 < PARAM_TEST_SIZE * 100 for url in chunk['url']])
+            else:
+                is_test = rng.rand(len(chunk)) < PARAM_TEST_SIZE
+            # a chunk can fall entirely on one side of the split
+            if (~is_test).any():
+                dump_svmlight_file(X[~is_test], y[~is_test], f_train, zero_based=True)
+            if is_test.any():
+                dump_svmlight_file(X[is_test], y[is_test], f_test, zero_based=True)
+            logger.info(f'featurized {i}th chunk.')
+
+    params = dict(PARAM_BOOSTER)
+    if hasattr(xgb, 'DataIter'):
+        params['tree_method'] = 'hist'
+    dtrain = external_memory_dmatrix(train_path, featurizer.n_columns, chunksize)
+    booster = xgb.train(params, dtrain, num_boost_round=PARAM_NUM_BOOST_ROUND)
+
+    squared_error = 0.0
+    n = 0
+    for X_test, y_true in iter_svmlight(test_path, featurizer.n_columns, chunksize):
+        y_test = booster.predict(xgb.DMatrix(X_test))
+        squared_error += np.sum((y_true - y_test) ** 2)
+        n += len(y_true)
+    logger.info(np.sqrt(squared_error / max(n, 1)))
+
+    with open(FILE_MODEL, 'wb') as f:
+        dill.dump(HashedModel(featurizer, booster), f)
+    logger.info('model saved')
 
 # https://github.com/michelleful/SingaporeRoadnameOrigins/blob/24c5162cc8c544d8dfe220c7001382baeb4b3084/notebooks/04%20Adding%20features%20with%20Pipelines.ipynb
 def train(df):
-    features = df.drop(['attr_name', 'parent_attr_name', 'score'], axis=1)
+    features = df.drop(['attr_name', 'parent_attr_name', 'score', 'url'], axis=1, errors='ignore')
     scores = df['score']
     X_train, X_test, y_train, y_true = train_test_split(features, scores, test_size=0.2)
     ngram_counter = CountVectorizer(ngram_range=(3, 5), analyzer='char', preprocessor=preprocess)
@@ -83,10 +157,10 @@ def train(df):
         )),
     ])
 
+    model.fit(X_train, y_train)
     y_test = model.predict(X_test)
     logger.info(np.sqrt(mean_squared_error(y_true, y_test)))
 
-    FILE_MODEL = 'data/model.pkl'
     with open(FILE_MODEL, 'wb') as f:
         dill.dump(model, f)
     logger.info('model saved')
@@ -0,0 +1,112 @@
+import logging
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from joblib import Parallel, delayed
+from sklearn.model_selection import GroupKFold, ParameterGrid
+import xgboost as xgb
+
+from extractor.train import HashedFeatures, prepare, DIR_CACHE, PARAM_BOOSTER, PARAM_CHUNK_SIZE, PARAM_NUM_BOOST_ROUND
+from extractor.util import configure_logging
+
+configure_logging()
+logger = logging.getLogger('applog.' + __name__)
+
+FILE_TUNE_RESULT = 'data/tune.csv'
+PARAM_N_SPLITS = 5
+PARAM_GRID = {
+    'max_depth': [3, 5, 7],
+    'min_child_weight': [1, 3, 5],
+    'eta': [0.05, 0.1],
+    'num_boost_round': [PARAM_NUM_BOOST_ROUND],
+}
+
+def build_matrix(path, chunksize=PARAM_CHUNK_SIZE):
+    """
+    Featurize the features file once and cache the sparse matrix on disk.
+    The cache is keyed by the file path, size and modification time.
+    Rows are grouped by article (url), or by row when the file has no url column.
+    """
+    featurizer = HashedFeatures()
+    stat = os.stat(path)
+    key = hashlib.sha1(f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime}:{featurizer.n_features}'.encode()).hexdigest()[:16]
+    matrix_path = os.path.join(DIR_CACHE, f'tune-{key}.npz')
+    target_path = os.path.join(DIR_CACHE, f'tune-{key}-target.npz')
+    if os.path.exists(matrix_path) and os.path.exists(target_path):
+        logger.info(f'load cached feature matrix: {matrix_path}')
+        target = np.load(target_path)
+        return sparse.load_npz(matrix_path), target['y'], target['groups']
+
+    Xs, ys, urls = [], [], []
+    offset = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        chunk = prepare(chunk)
+        Xs.append(featurizer.transform(chunk))
+        ys.append(chunk['score'].values.astype(np.float64))
+        urls.append(chunk['url'].values if 'url' in chunk else np.arange(offset, offset + len(chunk)))
+        offset += len(chunk)
+
+    X = sparse.vstack(Xs, format='csr')
+    y = np.concatenate(ys)
+    groups, _ = pd.factorize(np.concatenate(urls))
+
+    os.makedirs(DIR_CACHE, exist_ok=True)
+    sparse.save_npz(matrix_path, X)
+    np.savez(target_path, y=y, groups=groups)
+    logger.info(f'cached feature matrix: {matrix_path}, shape={X.shape}')
+    return X, y, groups
+
+def extraction_accuracy(groups, y_true, y_pred):
+    """
+    Ratio of articles whose best predicted node has the highest label of the article.
+    """
+    df = pd.DataFrame({'group': groups, 'y_true': y_true, 'y_pred': y_pred})
+    df = df[df.groupby('group')['y_true'].transform('max') > 0]
+    if len(df) == 0:
+        return np.nan
+    best = df.loc[df.groupby('group')['y_pred'].idxmax()]
+    max_true = df.groupby('group')['y_true'].max()
+    return float(np.mean(best['y_true'].values == max_true.loc[best['group']].values))
+
+def _fit_fold(X, y, groups, train_idx, test_idx, params):
+    params = dict(params)
+    num_boost_round = params.pop('num_boost_round')
+    # parallelism comes from the folds
+    params['nthread'] = 1
+    booster = xgb.train(params, xgb.DMatrix(X[train_idx], label=y[train_idx]), num_boost_round=num_boost_round)
+    y_pred = booster.predict(xgb.DMatrix(X[test_idx]))
+    rmse = float(np.sqrt(np.mean((y[test_idx] - y_pred) ** 2)))
+    return rmse, extraction_accuracy(groups[test_idx], y[test_idx], y_pred)
+
+def tune(path, n_jobs=-1, chunksize=PARAM_CHUNK_SIZE, param_grid=PARAM_GRID, n_splits=PARAM_N_SPLITS):
+    """
+    Grid search over booster params with k-fold CV grouped by article, folds run in parallel.
+    """
+    X, y, groups = build_matrix(path, chunksize)
+    folds = list(GroupKFold(n_splits=n_splits).split(X, y, groups))
+    configs = [dict(PARAM_BOOSTER, **params) for params in ParameterGrid(param_grid)]
+
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_fold)(X, y, groups, train_idx, test_idx, params)
+        for params in configs for train_idx, test_idx in folds
+    )
+
+    results = []
+    for i, params in enumerate(configs):
+        rmses, accuracies = zip(*scores[i * n_splits:(i + 1) * n_splits])
+        result = dict(params)
+        result.update({
+            'rmse': np.mean(rmses),
+            'rmse_std': np.std(rmses),
+            'accuracy': np.nanmean(accuracies),
+            'accuracy_std': np.nanstd(accuracies),
+        })
+        logger.info(f'{params}: rmse={round(result["rmse"], 5)}; accuracy={round(result["accuracy"], 5)}')
+        results.append(result)
+
+    df = pd.DataFrame(results).sort_values(['accuracy', 'rmse'], ascending=[False, True])
+    df.to_csv(FILE_TUNE_RESULT, index=False)
+    logger.info(f'best params: {df.iloc[0].to_dict()}')
+    return df
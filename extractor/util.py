@@ -1,16 +1,46 @@
 import os
 import yaml
+import dill
 import re
 import logging.config
 import signal
 from contextlib import contextmanager
+from functools import lru_cache
 
+@lru_cache(maxsize=None)
 def load_log_config():
     env = os.getenv('ENV', 'prd')
     with open(os.path.join(os.path.dirname(__file__), f'../config/log_conf_{env}.yml'), 'r') as f:
         config = yaml.load(stream=f, Loader=yaml.SafeLoader)
     return config
 
+_logging_configured = False
+
+def configure_logging():
+    """
+    Configure logging once per process, however many modules call it at import time.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    logging.config.dictConfig(load_log_config())
+    _logging_configured = True
+
+FILE_MODEL = 'data/model.pkl'
+
+# names pickled from `extractor.train` by older models, now defined in `extractor.estimator`
+MOVED_ESTIMATORS = frozenset(['Extractor', 'Apply', 'preprocess', 'HashedFeatures', 'HashedModel'])
+
+class ModelUnpickler(dill.Unpickler):
+    def find_class(self, module, name):
+        if module == 'extractor.train' and name in MOVED_ESTIMATORS:
+            module = 'extractor.estimator'
+        return super().find_class(module, name)
+
+def load_model(path=FILE_MODEL):
+    with open(path, 'rb') as f:
+        return ModelUnpickler(f).load()
+
 def remove_space(text):
     if text is None:
         return ''
@@ -3,3 +3,5 @@ workers = 2
 threads = 2
 timeout = 30
 keepalive = 2
+# load the app and the model once in the master and fork workers from it
+preload_app = True
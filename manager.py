@@ -1,9 +1,20 @@
 import argparse
 import csv
+import glob
+import json
+import os
 import pandas as pd
 
-from extractor.feature import get_feature
-from extractor.train import train
+from extractor.feature import get_feature, recompute_features
+from extractor.train import train, train_chunked, prepare, PARAM_CHUNK_SIZE
+from extractor.pool import ExtractionPool, benchmark
+from extractor.tune import tune
+from extractor.content_extractor import evaluate_prefilter
+from extractor.startup import profile_startup
+from extractor.boilerplate import BoilerplateIndex
+from extractor.loadtest import loadtest, compare, PARAM_CONCURRENCY, PARAM_DURATION
+from extractor.util import load_model
+from extractor import kernel
 
 
 def make_features(path):
@@ -13,20 +24,83 @@ def make_features(path):
     get_feature(data)
 
 
-def train_model(path):
-    df = pd.read_csv(path)
-    df = df.fillna({'title_dist': 0.0})
-    df['concat_attr_name'] = df['attr_name'].str.cat(df['parent_attr_name'], sep='|')
+def train_model(path, chunk_size=None):
+    if chunk_size is not None:
+        train_chunked(path, chunk_size)
+        return
+    df = prepare(pd.read_csv(path))
     train(df)
 
 
+def load_snapshot(path):
+    return sorted(glob.glob(os.path.join(path, '**', '*.html'), recursive=True))
+
+
+def extract_snapshot(path, workers=None):
+    paths = load_snapshot(path)
+    with ExtractionPool(processes=workers) as pool, open('data/extracted.jsonl', 'w') as f:
+        for idx, result in pool.imap(read_snapshot(path)):
+            result['path'] = paths[idx]
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+def read_snapshot(path):
+    for html_path in load_snapshot(path):
+        with open(html_path, 'rb') as f:
+            yield f.read()
+
+
+def prefilter_report(path):
+    evaluate_prefilter(load_model(), read_snapshot(path))
+
+
+def build_boilerplate(path):
+    BoilerplateIndex().build(path).save()
+
+
+def benchmark_snapshot(path, workers=None):
+    benchmark(list(read_snapshot(path)), max_processes=workers)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='')
-    parser.add_argument('-t', '--task', choices=['feature', 'train'], required=True, help='choose task to apply')
-    parser.add_argument('-d', '--data-path', required=True, help='path to data')
+    parser.add_argument('-t', '--task', choices=['feature', 'refeature', 'train', 'extract', 'benchmark', 'tune', 'prefilter-report', 'startup-profile', 'boilerplate', 'loadtest', 'loadtest-compare', 'kernel-check'], required=True, help='choose task to apply')
+    parser.add_argument('-d', '--data-path', help='path to data (required except for kernel-check)')
+    parser.add_argument('-w', '--workers', type=int, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--chunk-size', type=int, help='train streaming the features file in chunks of this many rows')
+    parser.add_argument('--threads', type=int, help='loadtest: threads per gunicorn worker (default: gunicorn_conf.py)')
+    parser.add_argument('--timeout', type=int, help='loadtest: gunicorn worker timeout (default: gunicorn_conf.py)')
+    parser.add_argument('--concurrency', type=int, default=PARAM_CONCURRENCY, help='loadtest: number of concurrent clients')
+    parser.add_argument('--rate', type=float, help='loadtest: requests per second arriving as a Poisson process (default: back to back)')
+    parser.add_argument('--duration', type=int, default=PARAM_DURATION, help='loadtest: seconds to send requests')
+    parser.add_argument('--compare', help='loadtest-compare: saved report to compare with the one given by -d')
     args = parser.parse_args()
+    if args.task != 'kernel-check' and args.data_path is None:
+        parser.error('-d/--data-path is required')
+    if args.task == 'loadtest-compare' and args.compare is None:
+        parser.error('--compare is required for loadtest-compare')
 
     if args.task == 'feature':
         make_features(args.data_path)
+    elif args.task == 'refeature':
+        recompute_features(args.data_path)
     elif args.task == 'train':
-        train_model(args.data_path)
+        train_model(args.data_path, args.chunk_size)
+    elif args.task == 'extract':
+        extract_snapshot(args.data_path, args.workers)
+    elif args.task == 'benchmark':
+        benchmark_snapshot(args.data_path, args.workers)
+    elif args.task == 'prefilter-report':
+        prefilter_report(args.data_path)
+    elif args.task == 'loadtest':
+        loadtest(args.data_path, args.workers, args.threads, args.timeout, args.concurrency, args.rate, args.duration)
+    elif args.task == 'loadtest-compare':
+        compare(args.compare, args.data_path)
+    elif args.task == 'boilerplate':
+        build_boilerplate(args.data_path)
+    elif args.task == 'startup-profile':
+        profile_startup(args.data_path)
+    elif args.task == 'kernel-check':
+        kernel.check()
+    elif args.task == 'tune':
+        tune(args.data_path, n_jobs=args.workers or -1, chunksize=args.chunk_size or PARAM_CHUNK_SIZE)
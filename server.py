@@ -1,48 +1,74 @@
 import logging
-from flask import Flask, request, jsonify
-import dill
-from bs4 import BeautifulSoup
-import requests
+from flask import Flask, Response, request, jsonify
 import json
+import gzip
+import os
 
 from extractor.content_extractor import extract
-from extractor.parser import Parser
-from extractor.util import load_log_config
+from extractor.diagnostics import should_trace, emit_trace, TRACE_HEADER
+from extractor.boilerplate import BoilerplateIndex, load_index, FILE_BOILERPLATE
+from extractor.incremental import FingerprintStore
+from extractor.util import configure_logging, load_model
 
-logging.config.dictConfig(load_log_config())
+configure_logging()
 logger = logging.getLogger('applog.' + __name__)
 
 app = Flask(__name__)
 
-with open('data/model.pkl', 'rb') as f:
-    model = dill.load(f)
-    logger.info('loaded model')
+model = load_model()
+logger.info('loaded model')
+
+# upper limit of the (decompressed) HTML size
+PARAM_MAX_CONTENT_LENGTH = 32 * 1024 * 1024
+# number of URLs whose subtree fingerprints are kept for re-extraction in each worker, 0 disables it
+PARAM_INCREMENTAL_MAX_URLS = int(os.getenv('EXTRACT_INCREMENTAL_MAX_URLS', '0'))
+URL_HEADER = 'X-Extract-Url'
+
+store = FingerprintStore(PARAM_INCREMENTAL_MAX_URLS) if PARAM_INCREMENTAL_MAX_URLS > 0 else None
+
+# drop the blocks repeated across the pages of a domain, starting from the index built by `manager.py -t boilerplate`
+PARAM_BOILERPLATE = os.getenv('EXTRACT_BOILERPLATE', '0') not in ('', '0', 'false')
+boilerplate = None
+if PARAM_BOILERPLATE:
+    boilerplate = load_index() if os.path.exists(FILE_BOILERPLATE) else BoilerplateIndex()
+    logger.info(f'boilerplate index: {len(boilerplate.domains)} domains')
 
 @app.route('/extract/body', methods=['POST'])
 def extract_content():
     result = {}
     try:
-        params = get_params(request.json)
-        html = params['html']
+        if request.mimetype == 'text/html':
+            html = read_body(request)
+            # the parser resolves the encoding from BOM, the charset, <meta charset> or detection
+            content_type = request.headers.get('Content-Type')
+            url = request.headers.get(URL_HEADER)
+        else:
+            params = get_params(request.json)
+            html = params['html']
+            content_type = None
+            url = params['url']
 
-        r = extract(model, html, True)
-        return {
+        r = extract(model, html, should_trace(TRACE_HEADER in request.headers), store=store, url=url, boilerplate=boilerplate, content_type=content_type)
+        if 'trace' in r:
+            emit_trace(r['trace'], path=request.path, score=r['score'])
+        return make_response({
             'content':    r['content'],
             'image_urls': r['image_urls'],
             'score':      r['score'],
-        }
+        })
 
     except Exception as e:
         result['status'] = 'NG'
         result['error'] = repr(e)
         logger.error(repr(e))
-        return jsonify(result)
+        return make_response(result)
 
     result['status'] = 'OK'
-    return jsonify(result)
+    return make_response(result)
 
 @app.route('/test', methods=['GET'])
 def test_extract_content():
+    import requests
     url = request.args.get('url')
     res = requests.get(url)
     res.encoding = res.apparent_encoding
@@ -54,10 +80,49 @@ def test_extract_content():
 def ping():
     return 'OK'
 
+def read_body(req):
+    """
+    Read raw HTML bytes from the request stream, decompressing gzip or zstd `Content-Encoding` on the fly.
+    """
+    content_encoding = req.headers.get('Content-Encoding', 'identity').lower()
+    stream = req.stream
+    if content_encoding == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream)
+    elif content_encoding == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception('zstd is not supported')
+        stream = zstandard.ZstdDecompressor().stream_reader(stream)
+    elif content_encoding != 'identity':
+        raise Exception(f'unsupported content encoding: {content_encoding}')
+
+    html = bytearray()
+    while True:
+        chunk = stream.read(1024 * 1024)
+        if not chunk:
+            break
+        html += chunk
+        if len(html) > PARAM_MAX_CONTENT_LENGTH:
+            raise Exception('html is too large')
+
+    if len(html) == 0:
+        raise Exception('html is required')
+    return bytes(html)
+
+def make_response(result):
+    """
+    Compact UTF-8 JSON without escaping non-ASCII characters when `compact` query parameter is given.
+    """
+    if request.args.get('compact') not in (None, '', '0', 'false'):
+        return Response(json.dumps(result, ensure_ascii=False, separators=(',', ':')), mimetype='application/json')
+    return jsonify(result)
+
 def get_params(data):
     params = {}
     if 'html' not in data:
         raise Exception('html is required')
     params['html'] = data['html']
+    params['url'] = data.get('url')
 
     return params